@@ -3,6 +3,34 @@ from flask import Flask
 # Initialize the Flask application
 app = Flask(__name__)
 
+# Limits for schedule generation; override with FLASK_SCHEDULER_* / FLASK_SOLVER_* /
+# FLASK_RESULT_CACHE_* / FLASK_SWEEP_* / FLASK_INSTRUMENTATION_ENABLED environment variables.
+# FLASK_SOLVER_SERVICE_* select the solver process the form's solves run in (see app.solver_service).
+app.config.from_mapping(
+    SCHEDULER_MAX_WORKERS=2,
+    SCHEDULER_MAX_QUEUE=10,
+    SCHEDULER_JOB_TIMEOUT=300,
+    SCHEDULER_MAX_CONCURRENCY=4,
+    SOLVER_TIME_LIMIT=60,
+    SOLVER_NUM_WORKERS=None,
+    SOLVER_SERVICE_ADDRESS=None,
+    SOLVER_SERVICE_AUTHKEY=None,
+    SOLVER_SERVICE_PREWARM=True,
+    RESULT_CACHE_SIZE=128,
+    RESULT_CACHE_PATH=None,
+    RESULT_CACHE_MAX_BYTES=50 * 1024 * 1024,
+    SWEEP_MAX_WORKERS=2,
+    SWEEP_MAX_VARIANTS=16,
+    SWEEP_TIME_LIMIT=30,
+    INSTRUMENTATION_ENABLED=False
+)
+app.config.from_prefixed_env()
+
+# Phase timings, solver statistics and request latencies (see app.metrics)
+if app.config['INSTRUMENTATION_ENABLED']:
+    from app.metrics import metrics
+    metrics.enable(app.logger.getChild('metrics'))
+
 # Import and register the main blueprint
 from app.main import main as main_blueprint
 app.register_blueprint(main_blueprint)
\ No newline at end of file
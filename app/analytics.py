@@ -0,0 +1,205 @@
+import numpy as np
+
+# Percentiles of the waits between a team's games reported for the whole schedule
+WAIT_PERCENTILES = (50, 75, 90, 95)
+
+def schedule_arrays(schedule, teams):
+    """Return the schedule as a team x slot occupancy array and the slots' minute offsets.
+
+    `occupancy[i, s]` counts the games team `teams[i]` plays in the `s`-th
+    entry of `schedule`; `offsets[s]` is that entry's start in minutes after
+    the first one.
+    """
+    index = {team: i for i, team in enumerate(teams)}
+    occupancy = np.zeros((len(teams), len(schedule)), dtype=np.int32)
+    if not schedule:
+        return occupancy, np.zeros(0)
+    rows = np.array([index[team] for _, matches in schedule for match in matches for team in match], dtype=np.int64)
+    cols = np.repeat(np.arange(len(schedule)), [2 * len(matches) for _, matches in schedule])
+    occupancy = np.bincount(rows * len(schedule) + cols, minlength=occupancy.size).reshape(occupancy.shape)
+    start = schedule[0][0]
+    offsets = np.array([(match_time - start).total_seconds() / 60 for match_time, _ in schedule])
+    return occupancy, offsets
+
+def slot_indices(offsets, slot_duration, long_break_time=0, long_break_frequency=0):
+    """Return the slot index of each minute offset, the inverse of `app.utils.slot_offsets`.
+
+    Offsets between slot starts fall into the slot they follow.
+    """
+    if long_break_frequency > 0:
+        block = long_break_frequency * slot_duration + long_break_time
+        blocks = offsets // block
+        return (blocks * long_break_frequency
+                + np.minimum((offsets - blocks * block) // slot_duration, long_break_frequency - 1)).astype(np.int64)
+    return (offsets // slot_duration).astype(np.int64)
+
+def _mean(total, count):
+    # Same value and type as statistics.mean: exact sums, one rounding, ints stay ints when whole
+    if isinstance(total, int):
+        return total // count if total % count == 0 else total / count
+    return total / count
+
+def analyze_schedule(schedule, teams, slot_duration, concurrency=None, game_time=None, long_break_time=0,
+                     long_break_frequency=0):
+    """Compute per-team, aggregate, rink and club statistics of a schedule with NumPy.
+
+    Returns a dict with per-team arrays under 'team' (games, first/last slot,
+    min/max/median/mean wait in minutes, longest run of back-to-back slots,
+    most slots sat out between two games),
+    the averages shown under the schedule, wait percentiles, rink utilization
+    (needs `concurrency`; the time-based figure also `game_time`) and per-club
+    fairness. Waits of teams with fewer than two games are NaN. Rests count
+    empty slots too, on the slot grid from the first entry given by the
+    long-break settings (see `slot_indices`).
+    """
+    num_teams, num_slots = len(teams), len(schedule)
+    occupancy, offsets = schedule_arrays(schedule, teams)
+    games = occupancy.sum(axis=1)
+    played = occupancy > 0
+
+    # Every game in team-major, slot-ascending order; the gaps within a team are its waits
+    rows, cols = np.nonzero(occupancy)
+    repeats = occupancy[rows, cols]
+    game_team, game_slot = np.repeat(rows, repeats), np.repeat(cols, repeats)
+    same_team = game_team[1:] == game_team[:-1]
+    waits = np.diff(offsets[game_slot])[same_team]
+    wait_team = game_team[1:][same_team]
+    wait_count = np.bincount(wait_team, minlength=num_teams)
+    has_waits = wait_count > 0
+
+    # Sorting each team's waits gives its min, median and max by position
+    sorted_waits = waits[np.lexsort((waits, wait_team))]
+    starts = (np.cumsum(wait_count) - wait_count)[has_waits]
+    counts = wait_count[has_waits]
+    min_wait, max_wait, median_wait = (np.full(num_teams, np.nan) for _ in range(3))
+    min_wait[has_waits] = sorted_waits[starts]
+    max_wait[has_waits] = sorted_waits[starts + counts - 1]
+    median_wait[has_waits] = (sorted_waits[starts + (counts - 1) // 2] + sorted_waits[starts + counts // 2]) / 2
+    mean_wait = np.full(num_teams, np.nan)
+    mean_wait[has_waits] = np.bincount(wait_team, weights=waits, minlength=num_teams)[has_waits] / counts
+
+    # Slots sat out between consecutive games, empty slots included
+    grid_slot = slot_indices(offsets, slot_duration, long_break_time, long_break_frequency)[game_slot]
+    max_rest = np.zeros(num_teams, dtype=np.int64)
+    np.maximum.at(max_rest, wait_team, np.diff(grid_slot)[same_team] - 1)
+
+    # Runs of slots exactly one slot duration apart, counting each slot once
+    run_start = np.ones(rows.size, dtype=bool)
+    run_start[1:] = (rows[1:] != rows[:-1]) | (np.diff(offsets[cols]) != slot_duration)
+    run_length = np.bincount(np.cumsum(run_start) - 1)
+    run_team = rows[run_start]
+    max_consecutive = np.zeros(num_teams, dtype=np.int64)
+    if run_team.size:
+        # Runs are grouped by team, so each team's longest is a reduction over its block
+        team_first_run = np.flatnonzero(np.r_[True, run_team[1:] != run_team[:-1]])
+        max_consecutive[run_team[team_first_run]] = np.maximum.reduceat(run_length, team_first_run)
+
+    first_slot = last_slot = np.full(num_teams, -1)
+    if num_slots:
+        first_slot = np.where(games > 0, played.argmax(axis=1), -1)
+        last_slot = np.where(games > 0, num_slots - 1 - played[:, ::-1].argmax(axis=1), -1)
+
+    two_or_more = games >= 2
+    one_or_more = games >= 1
+    waited = int(two_or_more.sum())
+    averages = {
+        'min_time_between': _mean(float(min_wait[two_or_more].sum()), waited) if waited else None,
+        'max_time_between': _mean(float(max_wait[two_or_more].sum()), waited) if waited else None,
+        'median_time_between': _mean(float(median_wait[two_or_more].sum()), waited) if waited else None,
+        'max_consecutive_matches': (_mean(int(max_consecutive[one_or_more].sum()), int(one_or_more.sum()))
+                                    if one_or_more.any() else None)
+    }
+
+    percentiles = np.percentile(waits, WAIT_PERCENTILES) if waits.size else [None] * len(WAIT_PERCENTILES)
+    wait_percentiles = {f"p{p}": None if value is None else float(value)
+                        for p, value in zip(WAIT_PERCENTILES, percentiles)}
+
+    matches = int(games.sum()) // 2
+    utilization = {'matches': matches, 'slots': num_slots, 'slot_utilization': None, 'time_utilization': None,
+                   'idle_rink_slots': None}
+    if concurrency and num_slots:
+        utilization['slot_utilization'] = matches / (concurrency * num_slots)
+        utilization['idle_rink_slots'] = concurrency * num_slots - matches
+        if game_time:
+            # Rink time booked for games over rink time from the first start to the last finish
+            utilization['time_utilization'] = float(matches * game_time / (concurrency * (offsets[-1] + game_time)))
+
+    return {
+        'team': {
+            'games': games,
+            'first_slot': first_slot,
+            'last_slot': last_slot,
+            'min_wait': min_wait,
+            'max_wait': max_wait,
+            'median_wait': median_wait,
+            'mean_wait': mean_wait,
+            'max_consecutive': max_consecutive,
+            'max_rest': max_rest
+        },
+        'averages': averages,
+        'wait_percentiles': wait_percentiles,
+        'utilization': utilization,
+        'clubs': club_fairness(teams, games, mean_wait, max_wait, first_slot, last_slot, offsets)
+    }
+
+def club_fairness(teams, games, mean_wait, max_wait, first_slot, last_slot, offsets):
+    """Compare clubs: average games, waits and time on site per club, and how evenly waits are shared.
+
+    'wait_spread' is the gap in minutes between the clubs with the longest and
+    shortest average wait; 'jain_index' is Jain's fairness index of the teams'
+    average waits (1 when every team waits the same).
+    """
+    club_names = sorted({club for club, _ in teams})
+    club_index = {club: i for i, club in enumerate(club_names)}
+    club_of = np.array([club_index[club] for club, _ in teams], dtype=np.int64)
+    num_clubs = len(club_names)
+    waited = ~np.isnan(mean_wait)
+    on_site = games > 0
+    span = np.where(on_site, offsets[last_slot] - offsets[first_slot] if offsets.size else 0, 0)
+
+    def club_mean(values, mask):
+        totals = np.bincount(club_of[mask], weights=values[mask], minlength=num_clubs)
+        counts = np.bincount(club_of[mask], minlength=num_clubs)
+        return np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+
+    club_games = club_mean(games.astype(float), np.ones(len(teams), dtype=bool))
+    club_wait = club_mean(mean_wait, waited)
+    club_max_wait = club_mean(max_wait, waited)
+    club_span = club_mean(span.astype(float), on_site)
+
+    def value(x):
+        return None if np.isnan(x) else float(x)
+
+    clubs = {name: {'teams': int((club_of == i).sum()), 'avg_games': value(club_games[i]),
+                    'avg_wait': value(club_wait[i]), 'avg_max_wait': value(club_max_wait[i]),
+                    'avg_span': value(club_span[i])}
+             for i, name in enumerate(club_names)}
+    known = club_wait[~np.isnan(club_wait)]
+    team_waits = mean_wait[waited]
+    squares = float((team_waits ** 2).sum())
+    return {
+        'clubs': clubs,
+        'wait_spread': float(known.max() - known.min()) if known.size else None,
+        'jain_index': float(team_waits.sum() ** 2 / (team_waits.size * squares)) if squares else None
+    }
+
+def team_statistics(analysis, schedule, teams):
+    """Return `team_games` and `team_timing_stats` in the form the templates and job results use."""
+    arrays = {key: values.tolist() for key, values in analysis['team'].items()}
+    # Slot -1 (no games) maps to None, as do NaN waits (the only values unequal to themselves)
+    times = [match_time for match_time, _ in schedule] + [None]
+    waits = zip(*(([None if x != x else x for x in arrays[key]]) for key in ('min_wait', 'max_wait', 'median_wait')))
+    team_games = dict(zip(teams, arrays['games']))
+    team_timing_stats = {
+        team: {
+            'first_match': times[first],
+            'last_match': times[last],
+            'min_time_between': min_wait,
+            'max_time_between': max_wait,
+            'median_time_between': median_wait,
+            'max_consecutive_matches': consecutive,
+            'max_rest_games': rest
+        } for team, first, last, (min_wait, max_wait, median_wait), consecutive, rest
+        in zip(teams, arrays['first_slot'], arrays['last_slot'], waits, arrays['max_consecutive'], arrays['max_rest'])
+    }
+    return team_games, team_timing_stats
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# Upper bound on relabelings tried while canonicalizing the club graph
+MAX_CANONICAL_LEAVES = 1000
+
+_cache_lock = threading.Lock()
+
+def _refine(names, adjacency, colors):
+    """Refine club colors by their neighbours' colors until the partition is stable."""
+    while True:
+        signature = {name: (colors[name], tuple(sorted(colors[other] for other in adjacency[name]))) for name in names}
+        palette = {value: i for i, value in enumerate(sorted(set(signature.values())))}
+        refined = {name: palette[signature[name]] for name in names}
+        if len(palette) == len(set(colors.values())):
+            return refined
+        colors = refined
+
+def canonical_club_order(clubs, home_club, restricted_clubs):
+    """Order clubs so that relabeled but otherwise identical tournaments get the same order.
+
+    Clubs are told apart only by team count, home status and restrictions.
+    Color refinement splits them by that structure and remaining ties are
+    broken by trying each club, keeping the order with the smallest signature.
+    Interchangeable clubs are tried once. Returns `(order, signature)`.
+    """
+    names = list(clubs)
+    adjacency = {name: set() for name in names}
+    for c1, c2 in restricted_clubs:
+        if c1 in adjacency and c2 in adjacency and c1 != c2:
+            adjacency[c1].add(c2)
+            adjacency[c2].add(c1)
+    attributes = {name: (name == home_club, len(clubs[name])) for name in names}
+    palette = {value: i for i, value in enumerate(sorted(set(attributes.values())))}
+    best = [None, None]
+    leaves = [0]
+
+    def signature(order):
+        index = {name: i for i, name in enumerate(order)}
+        edges = sorted(tuple(sorted((index[a], index[b]))) for a in names for b in adjacency[a] if a < b)
+        return [attributes[name] for name in order], edges
+
+    def search(colors):
+        colors = _refine(names, adjacency, colors)
+        classes = {}
+        for name in names:
+            classes.setdefault(colors[name], []).append(name)
+        ties = [members for color, members in sorted(classes.items()) if len(members) > 1]
+        if not ties:
+            leaves[0] += 1
+            order = sorted(names, key=colors.get)
+            candidate = signature(order)
+            if best[1] is None or candidate < best[1]:
+                best[:] = [order, candidate]
+            return
+        members = ties[0]
+        outside = [adjacency[name] - set(members) for name in members]
+        inside = {len(adjacency[name] & set(members)) for name in members}
+        twins = all(other == outside[0] for other in outside) and inside <= {0, len(members) - 1}
+        for name in members[:1] if twins else members:
+            if leaves[0] >= MAX_CANONICAL_LEAVES and best[0] is not None:
+                return
+            search({other: (colors[other], 0 if other == name else 1) for other in names})
+
+    search({name: palette[attributes[name]] for name in names})
+    return best[0], best[1]
+
+def canonical_key(clubs, home_club, restricted_clubs, **settings):
+    """Hash a tournament into a cache key that ignores club names and club order.
+
+    Returns `(key, club_order)`; `club_order` maps canonical club positions back
+    to this tournament's club names.
+    """
+    order, structure = canonical_club_order(clubs, home_club, restricted_clubs or set())
+    payload = json.dumps({'structure': structure, 'settings': settings}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest(), order
+
+class ResultCache:
+    """Two-tier cache of solved slot assignments, keyed by `canonical_key`.
+
+    The memory tier keeps the `max_entries` most recently used results. With a
+    `path`, results are also stored in a SQLite file that is trimmed to
+    `max_bytes` by dropping the least recently used entries. Assignments are
+    stored by canonical club position and team index and mapped back to the
+    requesting tournament's names on a hit.
+    """
+
+    def __init__(self, max_entries=128, path=None, max_bytes=50 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._connect() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS results "
+                           "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+
+    def get(self, key, clubs, club_order):
+        """Return `(slot_assignments, notes)` for `key` in this tournament's names, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            elif self.path:
+                with self._connect() as db:
+                    row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+                        value = row[0]
+                        self.disk_hits += 1
+                        self._remember(key, value)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        entry = json.loads(value)
+        return self._decode(entry['slots'], clubs, club_order), entry['notes']
+
+    def put(self, key, clubs, club_order, slot_assignments, notes):
+        """Store a solve result given in this tournament's names."""
+        value = json.dumps({'slots': self._encode(slot_assignments, clubs, club_order), 'notes': notes})
+        with self._lock:
+            self._remember(key, value)
+            if self.path:
+                with self._connect() as db:
+                    db.execute("INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                               (key, value, len(value), time.time()))
+                    total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                    while total > self.max_bytes:
+                        oldest, size = db.execute("SELECT key, size FROM results ORDER BY accessed LIMIT 1").fetchone()
+                        db.execute("DELETE FROM results WHERE key = ?", (oldest,))
+                        total -= size
+                        self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'memory_entries': len(self._entries),
+                'disk_entries': 0,
+                'disk_bytes': 0
+            }
+            if self.path:
+                with self._connect() as db:
+                    stats['disk_entries'], stats['disk_bytes'] = db.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            return stats
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _encode(slot_assignments, clubs, club_order):
+        if slot_assignments is None:
+            return None
+        position = {club: i for i, club in enumerate(club_order)}
+        return [[slot, [[position[c1], clubs[c1].index(t1), position[c2], clubs[c2].index(t2)]
+                        for (c1, t1), (c2, t2) in matchups]]
+                for slot, matchups in slot_assignments.items()]
+
+    @staticmethod
+    def _decode(slots, clubs, club_order):
+        if slots is None:
+            return None
+        teams = [(club, team) for club, club_teams in clubs.items() for team in club_teams]
+        rank = {team: i for i, team in enumerate(teams)}
+        slot_assignments = {}
+        for slot, matchups in slots:
+            decoded = []
+            for c1, t1, c2, t2 in matchups:
+                pair = sorted([(club_order[c1], clubs[club_order[c1]][t1]), (club_order[c2], clubs[club_order[c2]][t2])],
+                              key=rank.get)
+                decoded.append(tuple(pair))
+            slot_assignments[slot] = sorted(decoded, key=lambda matchup: (rank[matchup[0]], rank[matchup[1]]))
+        return slot_assignments
+
+def get_result_cache():
+    """Return the application's result cache, creating it on first use."""
+    with _cache_lock:
+        cache = current_app.extensions.get('result_cache')
+        if cache is None:
+            cache = ResultCache(
+                max_entries=current_app.config['RESULT_CACHE_SIZE'],
+                path=current_app.config['RESULT_CACHE_PATH'],
+                max_bytes=current_app.config['RESULT_CACHE_MAX_BYTES']
+            )
+            current_app.extensions['result_cache'] = cache
+        return cache
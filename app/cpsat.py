@@ -0,0 +1,101 @@
+"""CP-SAT helpers for the scheduling models.
+
+Importing this module loads OR-Tools, which takes a good part of a second, so
+the web-facing modules import it only once they actually solve.
+"""
+import time
+
+from ortools.sat.python import cp_model
+
+def warm_up():
+    """Load and exercise CP-SAT once, so the first real solve in this process does not pay for it."""
+    cp_model.CpSolver().Solve(cp_model.CpModel())
+
+class SolutionRecorder(cp_model.CpSolverSolutionCallback):
+    """Record the latest improving solution's objective and timing during a solve.
+
+    When `on_solution` is given, it is called with `build_result(self.BooleanValue)`
+    and the recorded entry, so callers can keep the best schedule so far.
+    """
+
+    def __init__(self, build_result=None, on_solution=None):
+        super().__init__()
+        self.latest = None
+        self.count = 0
+        self._build_result = build_result
+        self._on_solution = on_solution
+
+    def on_solution_callback(self):
+        entry = {'objective': self.ObjectiveValue(), 'wall_time': self.WallTime(), 'timestamp': time.time()}
+        self.latest = entry
+        self.count += 1
+        if self._on_solution is not None:
+            self._on_solution(self._build_result(self.BooleanValue), entry)
+
+def watch_presolve(solver):
+    """Log the solver's search to a callback and return a dict that receives the presolve start and end times."""
+    marks = {}
+
+    def on_log(line):
+        if line.startswith('Starting presolve'):
+            marks['start'] = time.perf_counter()
+        elif line.startswith('Preloading model'):
+            marks.setdefault('end', time.perf_counter())
+
+    solver.parameters.log_search_progress = True
+    solver.parameters.log_to_stdout = False
+    solver.log_callback = on_log
+    return marks
+
+def record_model_stats(stats, model, solver, status, presolve):
+    """Fill `stats` with a solved model's size, timings, objective and status."""
+    proto = model.Proto()
+    stats['variables'] = len(proto.variables)
+    stats['constraints'] = len(proto.constraints)
+    stats['presolve_time'] = presolve['end'] - presolve['start'] if 'start' in presolve and 'end' in presolve else None
+    stats['solve_time'] = solver.WallTime()
+    stats['status'] = solver.StatusName(status)
+    stats['objective'] = solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+
+def back_to_back_runs(offsets, slot_duration, length):
+    """Return the first slot of every `length` consecutive slots with no long break between them."""
+    return [slot for slot in range(len(offsets) - length + 1)
+            if offsets[slot + length - 1] - offsets[slot] == (length - 1) * slot_duration]
+
+def add_consecutive_limit(model, occupancy, runs, max_consecutive_games):
+    """Let a team play at most `max_consecutive_games` of the back-to-back slots starting at each of `runs`.
+
+    `occupancy` holds the team's 0/1 occupancy of every slot, as a variable,
+    an expression or a constant for a game that is fixed or impossible. Runs
+    decided by constants alone, and runs the fixed games already overfill,
+    are left out.
+    """
+    for start in runs:
+        window = occupancy[start:start + max_consecutive_games + 1]
+        if all(isinstance(term, int) for term in window) or sum(
+                term for term in window if isinstance(term, int)) > max_consecutive_games:
+            continue
+        model.Add(cp_model.LinearExpr.Sum(window) <= max_consecutive_games)
+
+def _fixed_game(occupancy):
+    return any(isinstance(term, int) and term for term in occupancy)
+
+def add_rest_limit(model, occupancy, played_by, plays_from, max_rest_games, reaches=None):
+    """Let a team sit out at most `max_rest_games` slots between two games.
+
+    Uses the wait chain's `played_by` / `plays_from` variables: a team that
+    has played by a slot and plays after the next `max_rest_games` + 1 slots
+    must play within them. `occupancy` is as for `add_consecutive_limit`;
+    windows whose rest the fixed games already break are left out. With the
+    wait chain's `reaches`, windows the wait limit already covers are skipped.
+    """
+    num_slots = len(occupancy)
+    for slot in range(num_slots - max_rest_games - 2):
+        last_rest = slot + max_rest_games + 1
+        if reaches is not None and reaches[slot] <= last_rest:
+            continue
+        window = occupancy[slot + 1:last_rest + 1]
+        if (all(isinstance(term, int) and not term for term in window) and _fixed_game(occupancy[:slot + 1])
+                and _fixed_game(occupancy[last_rest + 1:])):
+            continue
+        model.Add(played_by[slot] + plays_from[last_rest + 1] - cp_model.LinearExpr.Sum(window) <= 1)
@@ -0,0 +1,181 @@
+import itertools
+
+def circle_rounds(items):
+    """Yield the rounds of a circle-method round robin, each a list of disjoint pairs."""
+    order = list(items) + ([None] if len(items) % 2 else [])
+    size = len(order)
+    for _ in range(size - 1):
+        pairs = [(order[i], order[size - 1 - i]) for i in range(size // 2)]
+        yield [(a, b) for a, b in pairs if a is not None and b is not None]
+        order = [order[0], order[-1]] + order[1:-1]
+
+def match_targets(teams, allowed_matchups, matches_per_team, allow_more_matches, home_club):
+    """Return how many matches each team should play, or None if no valid total exists.
+
+    An odd total is only fixed when extra matches are allowed, by giving one away
+    team with the most possible opponents a single extra match.
+    """
+    targets = {team: matches_per_team for team in teams}
+    if len(teams) * matches_per_team % 2:
+        if not allow_more_matches:
+            return None
+        degree = {team: 0 for team in teams}
+        for t1, t2 in allowed_matchups:
+            degree[t1] += 1
+            degree[t2] += 1
+        candidates = [team for team in teams if team[0] != home_club]
+        if not candidates:
+            return None
+        targets[max(candidates, key=lambda team: degree[team])] += 1
+    return targets
+
+def select_matchups(teams, allowed_matchups, targets):
+    """Pick matchups so every team meets its target, or return None.
+
+    Pairs are taken round by round from a circle-method round robin over teams
+    interleaved by club, which spreads opponents evenly. Teams still short
+    afterwards are fixed by swapping one chosen matchup for two new ones.
+    """
+    by_club = {}
+    for team in teams:
+        by_club.setdefault(team[0], []).append(team)
+    order = [team for group in itertools.zip_longest(*by_club.values()) for team in group if team is not None]
+
+    lookup = {}
+    for matchup in allowed_matchups:
+        lookup[matchup[0], matchup[1]] = matchup
+        lookup[matchup[1], matchup[0]] = matchup
+    need = dict(targets)
+    chosen = set()
+
+    def add(matchup):
+        chosen.add(matchup)
+        need[matchup[0]] -= 1
+        need[matchup[1]] -= 1
+
+    for round_pairs in circle_rounds(order):
+        for a, b in round_pairs:
+            matchup = lookup.get((a, b))
+            if matchup is not None and need[a] > 0 and need[b] > 0:
+                add(matchup)
+
+    while any(need.values()):
+        short = [team for team in order if need[team] > 0]
+        repaired = False
+        for u, v in itertools.combinations_with_replacement(short, 2):
+            if u == v and need[u] < 2:
+                continue
+            matchup = lookup.get((u, v))
+            if matchup is not None and matchup not in chosen:
+                add(matchup)
+                repaired = True
+                break
+            for a, b in sorted(chosen):
+                for p, q in ((a, b), (b, a)):
+                    first, second = lookup.get((u, p)), lookup.get((v, q))
+                    if (first is None or second is None or first in chosen or second in chosen
+                            or first == second or u in (p, q) or v in (p, q)):
+                        continue
+                    chosen.remove((a, b))
+                    need[a] += 1
+                    need[b] += 1
+                    add(first)
+                    add(second)
+                    repaired = True
+                    break
+                if repaired:
+                    break
+            if repaired:
+                break
+        if not repaired:
+            return None
+    position = {matchup: m for m, matchup in enumerate(allowed_matchups)}
+    return sorted(chosen, key=position.get)
+
+def pack_slots(matchups, effective_concurrency, force_max_concurrency, offsets, max_wait_time,
+               max_consecutive_games=None, max_rest_games=None):
+    """Greedily place matchups into consecutive slots, or return None.
+
+    Each slot takes up to `effective_concurrency` matchups with no team twice,
+    and none that would give a team more than `max_consecutive_games` games
+    in back-to-back slots. Matchups whose teams would otherwise exceed
+    `max_wait_time` or `max_rest_games` go first, then those of teams with the
+    most games left, then those of teams that have waited longest. `offsets`
+    gives each slot's start in minutes and must cover one slot more than
+    there are matchups, or twice as many with `max_consecutive_games`, as
+    a slot may then stay empty.
+    """
+    remaining = list(matchups)
+    games_left = {}
+    for t1, t2 in remaining:
+        games_left[t1] = games_left.get(t1, 0) + 1
+        games_left[t2] = games_left.get(t2, 0) + 1
+    last_slot = {}
+    run = {}
+    slot_assignments = {}
+    slot = 0
+    # Slots one step apart are back to back; a long break makes the step longer
+    step = min((b - a for a, b in zip(offsets, offsets[1:])), default=0)
+
+    def run_length(team):
+        """Return the games `team` would have in a row by playing in `slot`."""
+        if last_slot.get(team) == slot - 1 and offsets[slot] - offsets[slot - 1] == step:
+            return run[team] + 1
+        return 1
+
+    def priority(matchup):
+        urgent = waited = 0
+        for team in matchup:
+            if team in last_slot:
+                waited += offsets[slot] - offsets[last_slot[team]]
+                if offsets[slot + 1] - offsets[last_slot[team]] > max_wait_time:
+                    urgent += 1
+                if max_rest_games is not None and slot - last_slot[team] > max_rest_games:
+                    urgent += 1
+        return (-urgent, -(games_left[matchup[0]] + games_left[matchup[1]]), -waited)
+
+    while remaining:
+        busy = set()
+        placed = []
+        for matchup in sorted(remaining, key=priority):
+            if len(placed) == effective_concurrency:
+                break
+            if matchup[0] in busy or matchup[1] in busy:
+                continue
+            if max_consecutive_games and any(run_length(team) > max_consecutive_games for team in matchup):
+                continue
+            placed.append(matchup)
+            busy.update(matchup)
+        # A slot stays empty only when every team left has to rest
+        if not placed and not max_consecutive_games:
+            return None
+        if force_max_concurrency and len(placed) < effective_concurrency:
+            return None
+        for matchup in placed:
+            remaining.remove(matchup)
+            for team in matchup:
+                games_left[team] -= 1
+                run[team] = run_length(team)
+                last_slot[team] = slot
+        slot_assignments[slot] = placed
+        slot += 1
+    return slot_assignments
+
+def construct_schedule(teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+                       allow_more_matches, home_club, offsets, max_wait_time, max_consecutive_games=None,
+                       max_rest_games=None):
+    """Build a schedule without a solver, as a dict of slot index to matchups, or None.
+
+    Returns None when the heuristic cannot meet the match counts or, with forced
+    concurrency, cannot fill every used slot; callers fall back to CP-SAT then.
+    """
+    targets = match_targets(teams, allowed_matchups, matches_per_team, allow_more_matches, home_club)
+    if targets is None:
+        return None
+    matchups = select_matchups(teams, allowed_matchups, targets)
+    if matchups is None:
+        return None
+    if force_max_concurrency and len(matchups) % effective_concurrency:
+        return None
+    return pack_slots(matchups, effective_concurrency, force_max_concurrency, offsets, max_wait_time,
+                      max_consecutive_games, max_rest_games)
@@ -0,0 +1,288 @@
+import atexit
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask import current_app
+
+from app.cache import ResultCache
+from app.utils import format_time, generate_and_schedule_matchups
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+# Seconds a job may overrun its solver time limit before its worker is killed
+KILL_GRACE = 5
+
+_manager_lock = threading.Lock()
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+def _run_job(conn, params, cache_path):
+    """Solve one tournament in a worker process, sending improving solutions and the result over `conn`."""
+    from app.lns import stop_workers_on_terminate
+    stop_workers_on_terminate()
+
+    def send_solution(result, info):
+        conn.send(('solution', (result, info)))
+
+    try:
+        # Worker processes are short-lived, so only the on-disk cache tier is shared with them
+        cache = ResultCache(max_entries=0, path=cache_path) if cache_path else None
+        conn.send(('done', generate_and_schedule_matchups(on_solution=send_solution, cache=cache, **params)))
+    except Exception as exc:
+        conn.send(('error', f"{type(exc).__name__}: {exc}"))
+    finally:
+        conn.close()
+
+class Job:
+    """A scheduling request and everything known about its progress."""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = QUEUED
+        self.result = None
+        self.progress = None
+        self.solution_count = 0
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.conn = None
+
+    def to_dict(self):
+        """Return the job's status as a JSON-friendly dict."""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'has_result': self.result is not None,
+            'solution_count': self.solution_count,
+            'progress': self.progress,
+            'error': self.error
+        }
+
+    def record_solution(self, result, info):
+        """Keep an improving solution as the job's result, replacing the previous one.
+
+        Only the latest schedule and its progress figures are kept, so a long
+        search does not accumulate history.
+        """
+        schedule = result[0]
+        self.result = result
+        self.solution_count += 1
+        self.progress = {
+            'solution': self.solution_count,
+            'objective': info.get('objective'),
+            'slots_used': len(schedule),
+            'end_time': (format_time(schedule[-1][0] + timedelta(minutes=self.params['game_time']))
+                         if schedule else None),
+            'solver_time': info.get('wall_time'),
+            'elapsed': time.time() - self.started_at
+        }
+
+class JobManager:
+    """Run scheduling jobs in a bounded set of worker processes.
+
+    At most `max_workers` solves run at once and at most `max_queue` jobs wait
+    for a free worker. Each solve is given `job_timeout` seconds as its solver
+    time limit, so it returns its best schedule when time runs out; a worker
+    still running KILL_GRACE seconds later is killed. The latest `retain`
+    finished jobs are kept for polling. Workers reuse results from the on-disk
+    result cache at `cache_path`, if given.
+    """
+
+    def __init__(self, max_workers=2, max_queue=10, job_timeout=300, retain=100, poll_interval=0.1, cache_path=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.retain = retain
+        self.poll_interval = poll_interval
+        self.cache_path = cache_path
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = OrderedDict()
+        self._pending = []
+        self._running = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+        self._dispatcher.start()
+        # Runs before multiprocessing's own exit handler, which would wait for running workers
+        atexit.register(self.shutdown)
+
+    def submit(self, params):
+        """Queue a solve for the `generate_and_schedule_matchups` keyword arguments and return its job id."""
+        with self._lock:
+            if len(self._pending) >= self.max_queue:
+                raise QueueFullError(f"Job queue is full ({self.max_queue} waiting).")
+            profile = dict(params.get('solver_profile') or {})
+            if profile.get('time_limit') is None or profile['time_limit'] > self.job_timeout:
+                profile['time_limit'] = self.job_timeout
+            job = Job(dict(params, solver_profile=profile))
+            self._jobs[job.id] = job
+            self._pending.append(job)
+        return job.id
+
+    def get(self, job_id):
+        """Return the job with `job_id`, or None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if it had already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return False
+            if job.status == QUEUED:
+                self._pending.remove(job)
+            else:
+                self._stop(job)
+            self._finish(job, CANCELLED)
+            return True
+
+    def accept(self, job_id):
+        """Finish a running job early with the best schedule found so far.
+
+        The search is stopped and the job ends as done. Returns False if the job
+        is not running or has no schedule yet.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != RUNNING:
+                return False
+            self._collect(job)
+            if job.status != RUNNING or job.result is None:
+                return False
+            self._stop(job)
+            elapsed = time.time() - job.started_at
+            job.result[1].insert(0, f"Accepted after {elapsed:.1f}s; showing the best schedule found so far, "
+                                    f"which is not proven optimal.")
+            self._finish(job, DONE)
+            return True
+
+    def shutdown(self):
+        """Stop the dispatcher and kill every running solve."""
+        self._stopped.set()
+        self._dispatcher.join()
+        with self._lock:
+            for job in list(self._running):
+                self._stop(job)
+                self._finish(job, CANCELLED)
+
+    def _dispatch(self):
+        while not self._stopped.wait(self.poll_interval):
+            with self._lock:
+                for job in list(self._running):
+                    self._collect(job)
+                    if job.status == RUNNING and time.time() - job.started_at > self.job_timeout + KILL_GRACE:
+                        self._stop(job)
+                        self._finish(job, TIMED_OUT)
+                while self._pending and len(self._running) < self.max_workers:
+                    job = self._pending.pop(0)
+                    try:
+                        self._start(job)
+                    except Exception as exc:
+                        job.error = f"Could not start worker: {exc}"
+                        self._finish(job, FAILED)
+
+    def _start(self, job):
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        # Not a daemon: large-neighbourhood search starts processes of its own
+        job.process = self._context.Process(target=_run_job, args=(child_conn, job.params, self.cache_path))
+        try:
+            job.process.start()
+        finally:
+            child_conn.close()
+        job.conn = parent_conn
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._running.append(job)
+
+    def _collect(self, job):
+        try:
+            while job.conn.poll():
+                kind, payload = job.conn.recv()
+                if kind == 'solution':
+                    job.record_solution(*payload)
+                elif kind == 'done':
+                    job.result = payload
+                    self._finish(job, DONE)
+                    return
+                elif kind == 'error':
+                    job.error = payload
+                    self._finish(job, FAILED)
+                    return
+        except (EOFError, OSError):
+            if job.status == RUNNING:
+                job.error = f"Worker exited with code {job.process.exitcode}."
+                self._finish(job, FAILED)
+
+    def _stop(self, job):
+        if job.process is not None and job.process.is_alive():
+            job.process.terminate()
+            job.process.join()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if job in self._running:
+            self._running.remove(job)
+            job.process.join()
+            job.conn.close()
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+        for old in finished[:max(0, len(finished) - self.retain)]:
+            del self._jobs[old.id]
+
+def get_job_manager():
+    """Return the application's job manager, creating it on first use."""
+    with _manager_lock:
+        manager = current_app.extensions.get('job_manager')
+        if manager is None:
+            manager = JobManager(
+                max_workers=current_app.config['SCHEDULER_MAX_WORKERS'],
+                max_queue=current_app.config['SCHEDULER_MAX_QUEUE'],
+                job_timeout=current_app.config['SCHEDULER_JOB_TIMEOUT'],
+                cache_path=current_app.config['RESULT_CACHE_PATH']
+            )
+            current_app.extensions['job_manager'] = manager
+        return manager
+
+def result_to_dict(result):
+    """Convert a `generate_and_schedule_matchups` result tuple into JSON-friendly data."""
+    schedule, warnings, team_games, team_opponents, team_timing_stats, teams = result
+
+    def stats_to_dict(stats):
+        return {key: format_time(value) if key in ('first_match', 'last_match') and value is not None else value
+                for key, value in stats.items()}
+
+    return {
+        'schedule': [
+            {'time': format_time(match_time),
+             'matches': [[{'club': c1, 'team': t1}, {'club': c2, 'team': t2}] for (c1, t1), (c2, t2) in matches]}
+            for match_time, matches in schedule
+        ],
+        'warnings': warnings,
+        'teams': [
+            {'club': club,
+             'team': team,
+             'games': team_games.get((club, team), 0),
+             'opponents': team_opponents.get((club, team), []),
+             'timing': stats_to_dict(team_timing_stats[(club, team)]) if (club, team) in team_timing_stats else None}
+            for club, team in teams
+        ]
+    }
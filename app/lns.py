@@ -0,0 +1,357 @@
+import math
+import multiprocessing
+import os
+import random
+import signal
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from ortools.sat.python import cp_model
+
+from app.cpsat import add_consecutive_limit, add_rest_limit, back_to_back_runs, record_model_stats
+
+# Neighbourhoods improve_schedule can free on each iteration
+NEIGHBOURHOODS = ('window', 'clubs', 'mixed')
+
+# Objective cost of one constraint violation, so the search repairs a start
+# schedule that breaks the wait limit before it shortens it
+VIOLATION_PENALTY = 100000
+
+def schedule_objective(slot_assignments):
+    """Score slot assignments the way the CP-SAT model does: early matches and a short schedule."""
+    used = [slot for slot, matchups in slot_assignments.items() if matchups]
+    return sum(slot * len(matchups) for slot, matchups in slot_assignments.items()) + 1000 * max(used, default=0)
+
+def schedule_problems(slot_assignments, effective_concurrency, force_max_concurrency, offsets, max_wait_time, runs=(),
+                      max_consecutive_games=None, max_rest_games=None):
+    """Count constraint violations: repeated matchups, team clashes, over-full slots and waits over the limit.
+
+    With `max_consecutive_games` every back-to-back run starting at one of
+    `runs` where a team plays more counts too, and with `max_rest_games`
+    every rest between two of a team's games that is longer.
+    """
+    problems = 0
+    seen = set()
+    team_slots = {}
+    for slot, matchups in slot_assignments.items():
+        if len(matchups) > effective_concurrency or (force_max_concurrency and 0 < len(matchups) < effective_concurrency):
+            problems += 1
+        busy = set()
+        for matchup in matchups:
+            key = frozenset(matchup)
+            problems += key in seen
+            seen.add(key)
+            for team in matchup:
+                problems += team in busy
+                busy.add(team)
+                team_slots.setdefault(team, []).append(slot)
+    for played in team_slots.values():
+        played.sort()
+        problems += sum(offsets[b] - offsets[a] > max_wait_time for a, b in zip(played, played[1:]))
+        if max_rest_games is not None:
+            problems += sum(b - a - 1 > max_rest_games for a, b in zip(played, played[1:]))
+        if max_consecutive_games:
+            slots = set(played)
+            problems += sum(sum(slot in slots for slot in range(start, start + max_consecutive_games + 1))
+                            > max_consecutive_games for start in runs)
+    return problems
+
+def solve_neighbourhood(task, stats=None):
+    """Re-solve the freed part of a schedule with everything else fixed.
+
+    `task` is a dict with the current `assignments`, the `freed` (matchup, slot)
+    pairs, the candidate `slots` freed matchups may move to, and the tournament
+    settings. Freed teams keep their number of games but may change opponents
+    among teams they have not met in the fixed part; a `need` dict of team to
+    (fewest, most) games in the freed part replaces those counts when given.
+    Waits over the limit are penalized with `soft_waits` and forbidden
+    otherwise, while the consecutive-game and rest limits are kept as in the
+    full model wherever freed games can decide them. A `stats` dict is filled
+    as by `app.cpsat.record_model_stats`. Returns the new placement of the
+    freed games as a dict of slot index to matchups, or None when no solution
+    was found in time.
+    """
+    assignments = task['assignments']
+    freed = set(task['freed'])
+    offsets = task['offsets']
+    num_slots = task['num_slots']
+    capacity = task['effective_concurrency']
+    max_wait_time = task['max_wait_time']
+
+    fixed = {slot: [m for m in matchups if (m, slot) not in freed] for slot, matchups in assignments.items()}
+    need = task['need']
+    if need is None:
+        need = {team: (count, count) for team, count in Counter(team for matchup, _ in freed for team in matchup).items()}
+    played = {frozenset(m) for matchups in fixed.values() for m in matchups}
+    busy = {(team, slot) for slot, matchups in fixed.items() for m in matchups for team in m}
+    candidates = [m for m in task['allowed_matchups']
+                  if need.get(m[0], (0, 0))[1] and need.get(m[1], (0, 0))[1] and frozenset(m) not in played]
+
+    model = cp_model.CpModel()
+    x = {(m, slot): model.NewBoolVar(f"x_{m}_{slot}") for m in range(len(candidates)) for slot in task['slots']
+         if (candidates[m][0], slot) not in busy and (candidates[m][1], slot) not in busy}
+    team_slot = {}
+    by_slot = {slot: [] for slot in task['slots']}
+    by_matchup = {m: [] for m in range(len(candidates))}
+    for (m, slot), var in x.items():
+        team_slot.setdefault((candidates[m][0], slot), []).append(var)
+        team_slot.setdefault((candidates[m][1], slot), []).append(var)
+        by_slot[slot].append(var)
+        by_matchup[m].append(var)
+
+    for team, (fewest, most) in need.items():
+        games = sum(var for slot in task['slots'] for var in team_slot.get((team, slot), []))
+        model.Add(games >= fewest)
+        model.Add(games <= most)
+    for variables in team_slot.values():
+        model.AddAtMostOne(variables)
+    for variables in by_matchup.values():
+        model.AddAtMostOne(variables)
+
+    # Start from the current placement of the freed matchups
+    position = {m: i for i, m in enumerate(candidates)}
+    current = {(position[m], slot) for m, slot in freed if m in position}
+    for key, var in x.items():
+        model.AddHint(var, key in current)
+
+    # No schedule ends before its last fixed game, or in fewer slots than its games fill
+    last_fixed = max((slot for slot, matchups in fixed.items() if matchups), default=0)
+    total_games = (sum(len(matchups) for matchups in fixed.values())
+                   + math.ceil(sum(fewest for fewest, _ in need.values()) / 2))
+    fewest_slot = min(max(last_fixed, math.ceil(total_games / capacity) - 1), num_slots - 1)
+    max_slot = model.NewIntVar(fewest_slot, num_slots - 1, "max_slot")
+    used = {}
+    for slot, variables in by_slot.items():
+        if not variables:
+            continue
+        used[slot] = model.NewBoolVar(f"used_{slot}")
+        count = len(fixed.get(slot, [])) + sum(variables)
+        model.Add(count <= capacity)
+        model.Add(sum(variables) <= capacity * used[slot])
+        model.Add(max_slot >= slot).OnlyEnforceIf(used[slot])
+        if task['force_max_concurrency']:
+            model.Add(count == capacity).OnlyEnforceIf(used[slot])
+            if fixed.get(slot):
+                model.Add(used[slot] == 1)
+    # The first slot stays in use, as in the full model
+    if not fixed.get(0) and by_slot.get(0):
+        model.Add(sum(by_slot[0]) >= 1)
+    if task['force_max_concurrency']:
+        slot_used = [used.get(slot, int(bool(fixed.get(slot)))) for slot in range(num_slots)]
+        for slot in range(num_slots - 1):
+            if not isinstance(slot_used[slot], int) or not isinstance(slot_used[slot + 1], int):
+                model.Add(slot_used[slot + 1] <= slot_used[slot])
+
+    # Same sliding-window wait rule as the full model, with fixed games as constants,
+    # softened with `soft_waits`: each broken window then costs VIOLATION_PENALTY.
+    violations = []
+    for team in need:
+        fixed_slots = {slot for slot in range(num_slots) if (team, slot) in busy}
+        occupancy = [sum(team_slot.get((team, slot), [])) if slot not in fixed_slots else 1 for slot in range(num_slots)]
+        played_by = [model.NewBoolVar(f"played_by_{team}_{slot}") for slot in range(num_slots)]
+        plays_from = [model.NewBoolVar(f"plays_from_{team}_{slot}") for slot in range(num_slots)]
+        for slot in range(num_slots):
+            model.Add(played_by[slot] >= occupancy[slot])
+            model.Add(plays_from[slot] >= occupancy[slot])
+            if slot > 0:
+                model.Add(played_by[slot] >= played_by[slot - 1])
+                model.Add(plays_from[slot - 1] >= plays_from[slot])
+        reach = 0
+        for slot in range(num_slots):
+            reach = max(reach, slot)
+            while reach + 1 < num_slots and offsets[reach + 1] - offsets[slot] <= max_wait_time:
+                reach += 1
+            if reach + 1 >= num_slots:
+                break
+            window = range(slot + 1, reach + 1)
+            if not task['soft_waits']:
+                model.Add(played_by[slot] + plays_from[reach + 1] - sum(occupancy[s] for s in window) <= 1)
+                continue
+            violated = model.NewBoolVar(f"wait_violated_{team}_{slot}")
+            model.Add(played_by[slot] + plays_from[reach + 1] - sum(occupancy[s] for s in window) <= 1 + violated)
+            violations.append(violated)
+
+        # Fixed games are constants in these windows, as in the wait chain
+        if task['max_rest_games'] is not None:
+            add_rest_limit(model, occupancy, played_by, plays_from, task['max_rest_games'])
+        if task['max_consecutive_games']:
+            add_consecutive_limit(model, occupancy, task['runs'], task['max_consecutive_games'])
+
+    model.Minimize(sum(slot * var for (_, slot), var in x.items()) + 1000 * max_slot
+                   + VIOLATION_PENALTY * sum(violations))
+
+    solver = cp_model.CpSolver()
+    if task['time_limit'] is not None:
+        solver.parameters.max_time_in_seconds = task['time_limit']
+    if task['relative_gap'] is not None:
+        solver.parameters.relative_gap_limit = task['relative_gap']
+    solver.parameters.num_search_workers = task['num_workers']
+    solver.parameters.random_seed = task['seed']
+    status = solver.Solve(model)
+    if stats is not None:
+        record_model_stats(stats, model, solver, status, {})
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+    placed = {}
+    for (m, slot), var in x.items():
+        if solver.BooleanValue(var):
+            placed.setdefault(slot, []).append(candidates[m])
+    return placed
+
+def _games(slot_assignments):
+    """Count each team's games."""
+    return Counter(team for matchups in slot_assignments.values() for matchup in matchups for team in matchup)
+
+def _long_waits(slot_assignments, offsets, max_wait_time):
+    """List (team, slot, next_slot) for every gap between a team's games over the wait limit."""
+    team_slots = {}
+    for slot, matchups in sorted(slot_assignments.items()):
+        for matchup in matchups:
+            for team in matchup:
+                team_slots.setdefault(team, []).append(slot)
+    return [(team, a, b) for team, played in team_slots.items() for a, b in zip(played, played[1:])
+            if offsets[b] - offsets[a] > max_wait_time]
+
+def _windows(rng, slot_assignments, num_slots, window_size, count, long_waits):
+    """Pick up to `count` non-overlapping windows of consecutive slots, leaving a slot between them.
+
+    When some wait is over the limit, the first window spans one such gap.
+    """
+    last_used = max((slot for slot, matchups in slot_assignments.items() if matchups), default=0)
+    starts = list(range(0, max(1, last_used - window_size + 2)))
+    rng.shuffle(starts)
+    chosen = []
+    if long_waits:
+        _, first, last = rng.choice(long_waits)
+        chosen.append(range(first, min(max(last + 1, first + window_size), num_slots)))
+    for start in starts:
+        if len(chosen) == count:
+            break
+        window = range(start, min(start + window_size, num_slots))
+        if all(window.stop < other.start or other.stop < window.start for other in chosen):
+            chosen.append(window)
+    return chosen
+
+def stop_workers_on_terminate():
+    """Make SIGTERM also stop the pool processes of a running search, which would otherwise outlive this process.
+
+    Call it in the main thread of a worker process that may run `improve_schedule`.
+    """
+    def stop(signum, frame):
+        for child in multiprocessing.active_children():
+            child.terminate()
+        os._exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, stop)
+
+def improve_schedule(slot_assignments, teams, allowed_matchups, effective_concurrency, force_max_concurrency,
+                     offsets, max_wait_time, num_slots, time_limit=60, neighbourhood='mixed', window_size=4,
+                     club_count=2, sub_time_limit=5, max_stale=10, max_iterations=None, workers=1, seed=0,
+                     on_iteration=None, slot_duration=None, max_consecutive_games=None, max_rest_games=None):
+    """Improve a feasible schedule by large-neighbourhood search.
+
+    Each iteration frees one or more neighbourhoods: windows of `window_size`
+    consecutive slots, the games of `club_count` random clubs, or both
+    alternately ('mixed'). Each neighbourhood is re-solved with CP-SAT for up
+    to `sub_time_limit` seconds while the rest of the schedule stays fixed.
+    With `workers` > 1, non-overlapping neighbourhoods are solved in parallel
+    processes and merged one by one. A merge is kept only if it keeps every
+    team's game count and improves the objective, where each violation found by
+    `schedule_problems` costs VIOLATION_PENALTY. Re-solved games keep
+    `max_consecutive_games` (in runs of back-to-back slots, which needs
+    `slot_duration`) and `max_rest_games`. The search stops after `time_limit` seconds,
+    `max_iterations` iterations, or `max_stale` iterations without improvement.
+    `on_iteration` is called with a dict describing every iteration.
+    Returns the best assignments and the iteration history.
+    """
+    if neighbourhood not in NEIGHBOURHOODS:
+        raise ValueError(f"Unknown neighbourhood {neighbourhood!r}; expected one of {', '.join(NEIGHBOURHOODS)}.")
+    rng = random.Random(seed)
+    clubs = sorted({team[0] for team in teams})
+    current = {slot: list(slot_assignments.get(slot, [])) for slot in range(num_slots)}
+    runs = []
+    if max_consecutive_games and slot_duration is not None:
+        runs = back_to_back_runs(offsets[:num_slots], slot_duration, max_consecutive_games + 1)
+
+    def score(candidate):
+        problems = schedule_problems(candidate, effective_concurrency, force_max_concurrency, offsets, max_wait_time,
+                                     runs, max_consecutive_games, max_rest_games)
+        return schedule_objective(candidate) + VIOLATION_PENALTY * problems
+
+    objective = score(current)
+    history = []
+    started = time.monotonic()
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    try:
+        iteration = stale = 0
+        while stale < max_stale and (max_iterations is None or iteration < max_iterations):
+            remaining = time_limit - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            kind = neighbourhood if neighbourhood != 'mixed' else ('window', 'clubs')[iteration % 2]
+            long_waits = _long_waits(current, offsets, max_wait_time)
+            if kind == 'window':
+                regions = [(list(window), [(m, slot) for slot in window for m in current[slot]])
+                           for window in _windows(rng, current, num_slots, window_size, workers, long_waits)]
+            else:
+                regions = []
+                pool = clubs[:]
+                rng.shuffle(pool)
+                # Free the club of a team waiting too long first
+                if long_waits:
+                    club = rng.choice(long_waits)[0][0]
+                    pool.remove(club)
+                    pool.insert(0, club)
+                for i in range(0, min(len(pool), club_count * workers), club_count):
+                    chosen = set(pool[i:i + club_count])
+                    regions.append((list(range(num_slots)), [(m, slot) for slot, matchups in current.items()
+                                                             for m in matchups if m[0][0] in chosen or m[1][0] in chosen]))
+            tasks = [{
+                'assignments': current,
+                'freed': freed,
+                'slots': slots,
+                'allowed_matchups': allowed_matchups,
+                'effective_concurrency': effective_concurrency,
+                'force_max_concurrency': force_max_concurrency,
+                'offsets': offsets,
+                'max_wait_time': max_wait_time,
+                'runs': runs,
+                'max_consecutive_games': max_consecutive_games if runs else None,
+                'max_rest_games': max_rest_games,
+                'need': None,
+                'soft_waits': True,
+                'num_slots': num_slots,
+                'time_limit': min(sub_time_limit, remaining),
+                'relative_gap': None,
+                'num_workers': 1 if executor else 0,
+                'seed': rng.randrange(1 << 30)
+            } for slots, freed in regions if freed]
+            results = list(executor.map(solve_neighbourhood, tasks)) if executor else [solve_neighbourhood(task) for task in tasks]
+
+            improved = False
+            for task, placed in zip(tasks, results):
+                if placed is None:
+                    continue
+                freed = set(task['freed'])
+                candidate = {slot: [m for m in matchups if (m, slot) not in freed] for slot, matchups in current.items()}
+                for slot, matchups in placed.items():
+                    candidate[slot] += matchups
+                candidate_objective = score(candidate)
+                if candidate_objective < objective and _games(candidate) == _games(current):
+                    current, objective, improved = candidate, candidate_objective, True
+
+            iteration += 1
+            stale = 0 if improved else stale + 1
+            entry = {'iteration': iteration, 'neighbourhood': kind, 'subproblems': len(tasks), 'objective': objective,
+                     'improved': improved, 'elapsed': time.monotonic() - started}
+            history.append(entry)
+            if on_iteration is not None:
+                on_iteration(current, entry)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return current, history
@@ -1,10 +1,185 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, Response, abort, current_app, g, jsonify, render_template, request, url_for
+from app.analytics import analyze_schedule, slot_indices
+from app.cache import get_result_cache
+from app.jobs import FINISHED_STATES, QueueFullError, get_job_manager, result_to_dict
+from app.metrics import metrics
+from app.repair import repair_schedule
+from app.solver_service import SolverUnavailableError, get_solver_service
+from app.sweep import get_sweep_runner
 from app.utils import parse_time, format_time, calculate_statistics, generate_and_schedule_matchups
-import statistics
+import ast
+import json
+import time
+import numpy as np
 
 # Define the main blueprint
 main = Blueprint('main', __name__)
 
+# Seconds between checks of a job's progress while streaming it, and between keep-alive comments
+EVENT_POLL_INTERVAL = 0.25
+EVENT_KEEPALIVE = 15
+
+def parse_restricted_clubs(form):
+    """Read the restricted club pairs carried in the form's hidden field."""
+    value = form.get('restricted_clubs', '')
+    if not value or value == 'set()':
+        return set()
+    return set(ast.literal_eval(value))
+
+def parse_clubs(form):
+    """Collect clubs and their generated team names, plus the number of club rows in the form."""
+    clubs = {}
+    club_count = 1
+    for key, value in form.items():
+        if key.startswith('club_name_') and value:
+            idx = key.split('_')[-1]
+            num_teams = int(form.get(f'num_teams_{idx}', 0))
+            clubs[value] = [f"{value}{i+1}" for i in range(num_teams)]
+            club_count = max(club_count, int(idx) + 1)
+    return clubs, club_count
+
+def parse_solver_profile(form):
+    """Build the solver profile from optional form fields on top of the app's solver settings."""
+    profile = {
+        'time_limit': current_app.config['SOLVER_TIME_LIMIT'],
+        'num_workers': current_app.config['SOLVER_NUM_WORKERS'],
+        'relative_gap': None,
+        'random_seed': None
+    }
+    for key, cast in (('time_limit', float), ('num_workers', int), ('relative_gap', float), ('random_seed', int)):
+        if form.get(key):
+            profile[key] = cast(form[key])
+    if form.get('symmetry_breaking'):
+        value = form['symmetry_breaking']
+        profile['symmetry_breaking'] = {'yes': True, 'no': False, 'off': False}.get(value, value)
+    # The configured worker count is a ceiling so one request cannot take over a shared host
+    if current_app.config['SOLVER_NUM_WORKERS'] is not None:
+        profile['num_workers'] = min(profile['num_workers'], current_app.config['SOLVER_NUM_WORKERS'])
+    return profile
+
+def parse_limit(form, key, default, minimum):
+    """Read an optional limit field: blank turns the limit off (None), a missing field gets `default`."""
+    value = form.get(key, default)
+    if value in ('', None):
+        return None
+    value = int(value)
+    if value < minimum:
+        raise ValueError(f"{key} must be at least {minimum}, or blank for no limit.")
+    return value
+
+def tournament_params(form, clubs, restricted_clubs):
+    """Extract the `generate_and_schedule_matchups` keyword arguments from the form."""
+    return {
+        'clubs': clubs,
+        'matches_per_team': int(form['matches_per_team']),
+        'concurrency': min(int(form['concurrency']), current_app.config['SCHEDULER_MAX_CONCURRENCY']),
+        'game_time': int(form['game_time']),
+        'break_time': int(form['break_time']),
+        'spread_games': form.get('spread_games') == 'yes',
+        'start_time': parse_time(form['start_time']),
+        'force_max_concurrency': form.get('force_max_concurrency') == 'yes',
+        'allow_more_matches': form.get('allow_more_matches') == 'yes',
+        'home_club': form.get('home_club', ''),
+        'restricted_clubs': restricted_clubs,
+        'long_break_time': int(form.get('long_break_time', 25)),
+        'long_break_frequency': int(form.get('long_break_frequency', 4)),
+        'game_scheduling_strategy': form.get('game_scheduling_strategy', 'cp'),
+        'max_consecutive_games': parse_limit(form, 'max_consecutive_games', 2, 1),
+        'max_rest_games': parse_limit(form, 'max_rest_games', 2, 0),
+        'max_wait_time': int(form.get('max_wait_time', 60)),
+        'solver_profile': parse_solver_profile(form)
+    }
+
+def json_tournament_params(data):
+    """Build `generate_and_schedule_matchups` keyword arguments from a JSON tournament spec.
+
+    The spec uses the form's field names, except that `clubs` maps each club to
+    its number of teams (or a list of team names), `restricted_clubs` is a list
+    of club pairs and yes/no fields may be booleans. A null max_consecutive_games
+    or max_rest_games turns that limit off, like a blank form field.
+    """
+    clubs = {name: list(value) if isinstance(value, list) else [f"{name}{i+1}" for i in range(int(value))]
+             for name, value in data['clubs'].items()}
+    restricted_clubs = {tuple(pair) for pair in data.get('restricted_clubs', [])}
+    form = {key: ('yes' if value else 'no') if isinstance(value, bool) else str(value)
+            for key, value in data.items() if key not in ('clubs', 'restricted_clubs') and value is not None}
+    form.update({key: '' for key in ('max_consecutive_games', 'max_rest_games') if key in data and data[key] is None})
+    return tournament_params(form, clubs, restricted_clubs)
+
+def schedule_from_dict(schedule):
+    """Turn the 'schedule' list of `result_to_dict` back into a schedule list."""
+    return [(parse_time(entry['time']),
+             [((first['club'], first['team']), (second['club'], second['team'])) for first, second in entry['matches']])
+            for entry in schedule]
+
+@main.before_app_request
+def start_request_trace():
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+        metrics.begin('request', method=request.method, endpoint=request.endpoint)
+
+@main.after_app_request
+def record_request_status(response):
+    metrics.annotate(status=response.status_code)
+    return response
+
+@main.teardown_app_request
+def finish_request_trace(exc):
+    if metrics.enabled and 'request_started' in g:
+        metrics.observe('scheduler_request_seconds', time.perf_counter() - g.request_started,
+                        endpoint=request.endpoint or 'unknown', method=request.method)
+        metrics.end()
+
+@main.route('/metrics', methods=['GET'])
+def metrics_text():
+    """Expose collected metrics in the Prometheus text format."""
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def render_result(result, params):
+    """Render the result page for a `generate_and_schedule_matchups` result."""
+    schedule, warnings, team_games, team_opponents, team_timing_stats, teams = result
+
+    # Calculate average timing stats
+    clock = metrics.stopwatch()
+    slot_duration = params['game_time'] + (params['break_time'] if params['spread_games'] else 0)
+    averages = analyze_schedule(schedule, teams, slot_duration)['averages']
+    clock.lap('timing_averages')
+
+    # Empty slots are not listed, so a long break follows an entry when the next one starts in a later block
+    long_break_after = set()
+    if params['long_break_frequency'] > 0 and schedule:
+        offsets = np.array([(match_time - params['start_time']).total_seconds() / 60 for match_time, _ in schedule])
+        blocks = slot_indices(offsets, slot_duration, params['long_break_time'],
+                              params['long_break_frequency']) // params['long_break_frequency']
+        long_break_after = {i for i in range(len(schedule) - 1) if blocks[i + 1] > blocks[i]}
+
+    return render_template(
+        'result.html',
+        schedule=schedule,
+        warnings=warnings,
+        team_games=team_games,
+        team_opponents=team_opponents,
+        team_timing_stats=team_timing_stats,
+        format_time=format_time,
+        analysis=len(schedule) == 0,
+        # The page's suggestions read the submitted settings; jobs viewed later have no form of their own
+        request=request if request.form else {'form': {'matches_per_team': params['matches_per_team'],
+                                                       'concurrency': params['concurrency']}},
+        avg_min_time=averages['min_time_between'],
+        avg_max_time=averages['max_time_between'],
+        avg_median_time=averages['median_time_between'],
+        avg_max_consecutive=averages['max_consecutive_matches'],
+        long_break_time=params['long_break_time'],
+        long_break_frequency=params['long_break_frequency'],
+        long_break_after=long_break_after,
+        game_scheduling_strategy=params['game_scheduling_strategy'],
+        max_consecutive_games=params['max_consecutive_games'],
+        max_rest_games=params['max_rest_games'],
+        max_wait_time=params['max_wait_time']
+    )
+
 @main.route('/', methods=['GET', 'POST'])
 def index():
     stats = None
@@ -13,24 +188,21 @@ def index():
     restricted_clubs = set()
     long_break_time = 25  # Default value
     long_break_frequency = 4  # Default value
-    game_scheduling_strategy = 'random'  # Default value
+    game_scheduling_strategy = 'cp'  # Default value
     max_consecutive_games = 2  # Default value
     max_rest_games = 2  # Default value
     max_wait_time = 60  # Default value
 
+    # Start loading the solver while the form is filled in
+    if request.method == 'GET' and current_app.config['SOLVER_SERVICE_PREWARM']:
+        get_solver_service().start()
+
     # Load existing restricted clubs from form
-    if 'restricted_clubs' in request.form:
-        restricted_clubs = set(eval(request.form['restricted_clubs'])) if request.form['restricted_clubs'] else set()
+    restricted_clubs = parse_restricted_clubs(request.form)
 
     if request.method == 'POST':
         form_data = request.form
-        clubs = {}
-        for key, value in request.form.items():
-            if key.startswith('club_name_') and value:
-                idx = key.split('_')[-1]
-                num_teams = int(request.form.get(f'num_teams_{idx}', 0))
-                clubs[value] = [f"{value}{i+1}" for i in range(num_teams)]
-                club_count = max(club_count, int(idx) + 1)
+        clubs, club_count = parse_clubs(request.form)
 
         # Handle adding club restrictions
         if 'add_restriction' in request.form:
@@ -40,25 +212,32 @@ def index():
                 restricted_clubs.add((club1, club2))
 
         # Extract form data
-        matches_per_team = int(request.form['matches_per_team'])
-        concurrency = min(int(request.form['concurrency']), 4)
-        game_time = int(request.form['game_time'])
-        break_time = int(request.form['break_time'])
-        spread_games = request.form.get('spread_games') == 'yes'
-        start_time = parse_time(request.form['start_time'])
-        force_max_concurrency = request.form.get('force_max_concurrency') == 'yes'
-        allow_more_matches = request.form.get('allow_more_matches') == 'yes'
-        home_club = request.form.get('home_club', '')
-        long_break_time = int(request.form.get('long_break_time', 25))
-        long_break_frequency = int(request.form.get('long_break_frequency', 4))
-        game_scheduling_strategy = request.form.get('game_scheduling_strategy', 'random')
-        max_consecutive_games = int(request.form.get('max_consecutive_games', 2))
-        max_rest_games = int(request.form.get('max_rest_games', 2))
-        max_wait_time = int(request.form.get('max_wait_time', 60))
+        try:
+            params = tournament_params(request.form, clubs, restricted_clubs)
+        except ValueError as exc:
+            abort(400, str(exc))
+        matches_per_team = params['matches_per_team']
+        concurrency = params['concurrency']
+        force_max_concurrency = params['force_max_concurrency']
+        allow_more_matches = params['allow_more_matches']
+        long_break_time = params['long_break_time']
+        long_break_frequency = params['long_break_frequency']
+        game_scheduling_strategy = params['game_scheduling_strategy']
+        max_consecutive_games = params['max_consecutive_games']
+        max_rest_games = params['max_rest_games']
+        max_wait_time = params['max_wait_time']
 
         if 'preview' in request.form:
             # Preview statistics
-            stats = calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches)
+            metrics.annotate(action='preview')
+            clock = metrics.stopwatch()
+            stats = calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches,
+                                         home_club=params['home_club'], restricted_clubs=restricted_clubs,
+                                         game_time=params['game_time'], break_time=params['break_time'],
+                                         spread_games=params['spread_games'], long_break_time=long_break_time,
+                                         long_break_frequency=long_break_frequency, max_wait_time=max_wait_time,
+                                         max_consecutive_games=max_consecutive_games)
+            clock.lap('preview_statistics')
             return render_template(
                 'index.html',
                 stats=stats,
@@ -73,62 +252,23 @@ def index():
                 max_rest_games=max_rest_games,
                 max_wait_time=max_wait_time
             )
+        elif 'generate_live' in request.form:
+            # Solve in the background and follow the search on the progress page
+            metrics.annotate(action='generate_live')
+            try:
+                job_id = get_job_manager().submit(params)
+            except QueueFullError as exc:
+                abort(503, str(exc))
+            return render_template('progress.html', job_id=job_id)
         elif 'generate' in request.form:
             # Generate and schedule matchups
-            schedule, warnings, team_games, team_opponents, team_timing_stats, teams = generate_and_schedule_matchups(
-                clubs, matches_per_team, concurrency, game_time, break_time, spread_games, start_time,
-                force_max_concurrency, allow_more_matches, home_club, restricted_clubs,
-                long_break_time, long_break_frequency, game_scheduling_strategy,
-                max_consecutive_games, max_rest_games, max_wait_time
-            )
-
-            # Calculate average timing stats
-            teams_with_two_or_more = [
-                t for t in teams
-                if t in team_games and team_games[t] >= 2 and team_timing_stats[t]['first_match'] is not None
-            ]
-            teams_with_one_or_more = [
-                t for t in teams
-                if t in team_games and team_games[t] >= 1 and team_timing_stats[t]['first_match'] is not None
-            ]
-
-            avg_min_time = (statistics.mean([team_timing_stats[t]['min_time_between']
-                                           for t in teams_with_two_or_more
-                                           if team_timing_stats[t]['min_time_between'] is not None])
-                           if teams_with_two_or_more else None)
-            avg_max_time = (statistics.mean([team_timing_stats[t]['max_time_between']
-                                           for t in teams_with_two_or_more
-                                           if team_timing_stats[t]['max_time_between'] is not None])
-                           if teams_with_two_or_more else None)
-            avg_median_time = (statistics.mean([team_timing_stats[t]['median_time_between']
-                                              for t in teams_with_two_or_more
-                                              if team_timing_stats[t]['median_time_between'] is not None])
-                              if teams_with_two_or_more else None)
-            avg_max_consecutive = (statistics.mean([team_timing_stats[t]['max_consecutive_matches']
-                                                  for t in teams_with_one_or_more])
-                                  if teams_with_one_or_more else None)
-
-            return render_template(
-                'result.html',
-                schedule=schedule,
-                warnings=warnings,
-                team_games=team_games,
-                team_opponents=team_opponents,
-                team_timing_stats=team_timing_stats,
-                format_time=format_time,
-                analysis=len(schedule) == 0,
-                request=request,
-                avg_min_time=avg_min_time,
-                avg_max_time=avg_max_time,
-                avg_median_time=avg_median_time,
-                avg_max_consecutive=avg_max_consecutive,
-                long_break_time=long_break_time,
-                long_break_frequency=long_break_frequency,
-                game_scheduling_strategy=game_scheduling_strategy,
-                max_consecutive_games=max_consecutive_games,
-                max_rest_games=max_rest_games,
-                max_wait_time=max_wait_time
-            )
+            metrics.annotate(action='generate')
+            try:
+                result = generate_and_schedule_matchups(cache=get_result_cache(), solve=get_solver_service().solve,
+                                                        **params)
+            except SolverUnavailableError as exc:
+                abort(503, str(exc))
+            return render_result(result, params)
 
     return render_template('index.html', stats=stats, club_count=club_count, form_data=form_data,
                          clubs=list(clubs.keys()) if 'clubs' in locals() else [],
@@ -138,4 +278,165 @@ def index():
                          game_scheduling_strategy=game_scheduling_strategy,
                          max_consecutive_games=max_consecutive_games,
                          max_rest_games=max_rest_games,
-                         max_wait_time=max_wait_time)
\ No newline at end of file
+                         max_wait_time=max_wait_time)
+
+@main.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a schedule generation from the same fields as the input form."""
+    try:
+        clubs, _ = parse_clubs(request.form)
+        params = tournament_params(request.form, clubs, parse_restricted_clubs(request.form))
+    except (KeyError, ValueError, SyntaxError) as exc:
+        return jsonify({'error': f"Invalid tournament settings: {exc}"}), 400
+    try:
+        job_id = get_job_manager().submit(params)
+    except QueueFullError as exc:
+        return jsonify({'error': str(exc)}), 503
+    return jsonify({'job_id': job_id, 'status_url': url_for('main.job_status', job_id=job_id)}), 202
+
+@main.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the status of a queued or finished job."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@main.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Return the best schedule the job has produced so far."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    result = result_to_dict(job.result) if job.result is not None else None
+    return jsonify({'status': job.status, 'result': result})
+
+@main.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream a job's progress as Server-Sent Events.
+
+    A `progress` event carries each improving solution's objective, slots
+    used, projected end time and elapsed time; a final `done` event carries
+    the job's status. Only the job's latest state is read, so a slow client
+    skips intermediate solutions rather than queueing them.
+    """
+    manager = get_job_manager()
+    if manager.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    def events():
+        seen = None
+        last_sent = time.monotonic()
+        while True:
+            job = manager.get(job_id)
+            if job is None:
+                yield f"event: done\ndata: {json.dumps({'status': 'expired'})}\n\n"
+                return
+            if job.solution_count != seen and job.progress is not None:
+                seen = job.solution_count
+                last_sent = time.monotonic()
+                yield f"event: progress\ndata: {json.dumps(job.progress)}\n\n"
+            if job.status in FINISHED_STATES:
+                yield f"event: done\ndata: {json.dumps({'status': job.status, 'error': job.error})}\n\n"
+                return
+            if time.monotonic() - last_sent > EVENT_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(EVENT_POLL_INTERVAL)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@main.route('/jobs/<job_id>/accept', methods=['POST'])
+def accept_job(job_id):
+    """Stop a running job's search and keep the best schedule found so far."""
+    manager = get_job_manager()
+    if manager.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'accepted': manager.accept(job_id)})
+
+@main.route('/jobs/<job_id>/view', methods=['GET'])
+def view_job(job_id):
+    """Show a job's schedule on the result page, or its progress page while it runs."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        abort(404)
+    if job.status not in FINISHED_STATES:
+        return render_template('progress.html', job_id=job_id)
+    result = job.result
+    if result is None:
+        result = ([], [job.error or f"The job ended as {job.status} without a schedule."], {}, {}, {}, [])
+    return render_result(result, job.params)
+
+@main.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Stop a queued or running job."""
+    manager = get_job_manager()
+    if manager.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'cancelled': manager.cancel(job_id)})
+
+@main.route('/cache', methods=['GET'])
+def cache_stats():
+    """Report result cache hit/miss counters."""
+    return jsonify(get_result_cache().stats())
+
+@main.route('/repair', methods=['POST'])
+def repair():
+    """Re-plan a generated schedule after a change, keeping unaffected slots.
+
+    Expects JSON with `tournament` (see `json_tournament_params`), the previous
+    `schedule` as returned by the job result endpoint and a `delta` (see
+    `app.repair.apply_delta`).
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        params = json_tournament_params(data['tournament'])
+        result = repair_schedule(params, schedule_from_dict(data['schedule']), data['delta'],
+                                 solve=get_solver_service().solve,
+                                 max_concurrency=current_app.config['SCHEDULER_MAX_CONCURRENCY'])
+    except (KeyError, TypeError, ValueError) as exc:
+        return jsonify({'error': f"Invalid repair request: {exc}"}), 400
+    except SolverUnavailableError as exc:
+        abort(503, str(exc))
+    return jsonify(result_to_dict(result))
+
+@main.route('/sweep', methods=['POST'])
+def sweep():
+    """Solve variants of one tournament side by side and compare their schedules.
+
+    Expects JSON with a base `tournament` (see `json_tournament_params`) and a
+    list of `variants`, each a dict of fields that override the base. Variants
+    are solved in parallel on the sweep worker pool; the response lists one
+    summary per variant, in order.
+    """
+    data = request.get_json(silent=True) or {}
+    variants = data.get('variants')
+    if not isinstance(variants, list) or not variants:
+        return jsonify({'error': "Invalid sweep request: 'variants' must be a non-empty list."}), 400
+    if len(variants) > current_app.config['SWEEP_MAX_VARIANTS']:
+        return jsonify({'error': f"Too many variants (at most {current_app.config['SWEEP_MAX_VARIANTS']})."}), 400
+    try:
+        params = [json_tournament_params(dict(data['tournament'], **variant)) for variant in variants]
+    except (KeyError, TypeError, ValueError, AttributeError) as exc:
+        return jsonify({'error': f"Invalid sweep request: {exc}"}), 400
+    results = get_sweep_runner().run(params)
+    return jsonify({'variants': [dict(result, overrides=variant) for variant, result in zip(variants, results)]})
+
+@main.route('/venues', methods=['POST'])
+def venues():
+    """Schedule a tournament over several rinks and days.
+
+    Expects JSON with `tournament` (see `json_tournament_params`; its
+    concurrency is ignored) and `venues` (see `app.venues.parse_venues`).
+    """
+    # Venue models are built in this process, so OR-Tools is only loaded here once venues are scheduled
+    from app.venues import schedule_tournament_venues
+
+    data = request.get_json(silent=True) or {}
+    try:
+        params = json_tournament_params(dict(data['tournament'], concurrency=1))
+        result = schedule_tournament_venues(params, data['venues'])
+    except (KeyError, TypeError, ValueError) as exc:
+        return jsonify({'error': f"Invalid venue request: {exc}"}), 400
+    return jsonify(result)
@@ -0,0 +1,198 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HELP = {
+    'scheduler_phase_seconds': ('histogram', "Time spent in each phase of schedule generation."),
+    'scheduler_request_seconds': ('histogram', "HTTP request latency."),
+    'scheduler_solver_wall_seconds': ('histogram', "CP-SAT wall time per solve."),
+    'scheduler_solves_total': ('counter', "CP-SAT solves by final status."),
+    'scheduler_solver_conflicts_total': ('counter', "CP-SAT conflicts over all solves."),
+    'scheduler_solver_branches_total': ('counter', "CP-SAT branches over all solves."),
+    'scheduler_model_variables': ('gauge', "Variables in the most recent CP-SAT model."),
+    'scheduler_model_constraints': ('gauge', "Constraints in the most recent CP-SAT model.")
+}
+
+class _NullStopwatch:
+    def lap(self, phase):
+        pass
+
+_NULL_STOPWATCH = _NullStopwatch()
+
+class Stopwatch:
+    """Time consecutive phases: each `lap` records the time since the previous one."""
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self._metrics.record_phase(phase, now - self._last)
+        self._last = now
+
+class Metrics:
+    """Process-wide phase timings, solver statistics and request latencies.
+
+    Disabled by default; while disabled every method returns immediately, so
+    the calls can stay in hot paths. Finished traces are logged as one JSON
+    line each on the `app.metrics` logger and `render` produces the
+    Prometheus text format.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._log = logger
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def enable(self, log=None):
+        """Start collecting; trace lines go to `log` (default: the `app.metrics` logger) at INFO."""
+        self.enabled = True
+        self._log = log or logger
+        if self._log.level == logging.NOTSET:
+            self._log.setLevel(logging.INFO)
+
+    def stopwatch(self):
+        """Return a stopwatch whose laps are recorded as phases."""
+        return Stopwatch(self) if self.enabled else _NULL_STOPWATCH
+
+    def begin(self, event, **fields):
+        """Start a trace on this thread, or add `fields` to the one already running.
+
+        Returns True when a new trace was started; only that caller should `end` it.
+        """
+        if not self.enabled:
+            return False
+        if getattr(self._local, 'trace', None) is not None:
+            self._local.trace.update(fields)
+            return False
+        self._local.trace = dict(fields, event=event, phases={}, started=time.time())
+        self._local.started = time.perf_counter()
+        return True
+
+    def annotate(self, **fields):
+        """Add fields to the trace running on this thread."""
+        if self.enabled and getattr(self._local, 'trace', None) is not None:
+            self._local.trace.update(fields)
+
+    def end(self):
+        """Finish this thread's trace, log it and return it."""
+        trace = getattr(self._local, 'trace', None)
+        if not self.enabled or trace is None:
+            return None
+        self._local.trace = None
+        trace['duration'] = time.perf_counter() - self._local.started
+        self._log.info(json.dumps(trace, default=str, sort_keys=True))
+        return trace
+
+    def take(self):
+        """Finish this thread's trace without logging it and return it, to `merge` in another process."""
+        trace = getattr(self._local, 'trace', None)
+        self._local.trace = None
+        return trace if self.enabled else None
+
+    def merge(self, trace):
+        """Record the phases and solver statistics of a trace taken in another process."""
+        if not self.enabled or not trace:
+            return
+        for phase, seconds in trace['phases'].items():
+            self.record_phase(phase, seconds)
+        if 'solver' in trace:
+            self._record_solver_stats(trace['model'], trace['solver'])
+
+    def record_phase(self, phase, seconds):
+        """Record the duration of a generation phase."""
+        if not self.enabled:
+            return
+        self.observe('scheduler_phase_seconds', seconds, phase=phase)
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace['phases'][phase] = trace['phases'].get(phase, 0) + seconds
+
+    def record_solve(self, model, solver, status):
+        """Record a finished CP-SAT solve: model size and the solver's search statistics."""
+        if not self.enabled:
+            return
+        proto = model.Proto()
+        model_stats = {'variables': len(proto.variables), 'constraints': len(proto.constraints)}
+        solver_stats = {'status': solver.StatusName(status), 'conflicts': solver.NumConflicts(),
+                        'branches': solver.NumBranches(), 'wall_time': solver.WallTime()}
+        self._record_solver_stats(model_stats, solver_stats)
+
+    def _record_solver_stats(self, model_stats, solver_stats):
+        self.set_gauge('scheduler_model_variables', model_stats['variables'])
+        self.set_gauge('scheduler_model_constraints', model_stats['constraints'])
+        self.increment('scheduler_solves_total', status=solver_stats['status'])
+        self.increment('scheduler_solver_conflicts_total', solver_stats['conflicts'])
+        self.increment('scheduler_solver_branches_total', solver_stats['branches'])
+        self.observe('scheduler_solver_wall_seconds', solver_stats['wall_time'])
+        self.annotate(model=model_stats, solver=solver_stats)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Add a value to a histogram."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                     'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def increment(self, name, amount=1, **labels):
+        """Add to a counter."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[name, tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            series = {}
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append((name, labels, value))
+            for (name, labels), value in self._gauges.items():
+                series.setdefault(name, []).append((name, labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                # Bucket counts are kept cumulative, as the format expects
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    series.setdefault(name, []).append((f"{name}_bucket", labels + (('le', bound),), count))
+                series[name].append((f"{name}_bucket", labels + (('le', '+Inf'),), histogram['count']))
+                series[name].append((f"{name}_sum", labels, histogram['sum']))
+                series[name].append((f"{name}_count", labels, histogram['count']))
+        for name in sorted(series):
+            kind, text = HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in series[name]:
+                label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels)
+                lines.append(f"{sample}{{{label_text}}} {value}" if label_text else f"{sample} {value}")
+        return '\n'.join(lines) + '\n'
+
+# The process-wide instance used by the scheduler and the web app
+metrics = Metrics()
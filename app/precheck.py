@@ -0,0 +1,223 @@
+import math
+from collections import deque
+
+def team_match_bounds(teams, matches_per_team, allow_more_matches, home_club):
+    """Return the (fewest, most) matches each team may play, as the scheduling model allows them."""
+    bounds = {}
+    for team in teams:
+        extra = allow_more_matches and not (home_club and team[0] == home_club)
+        bounds[team] = (matches_per_team, matches_per_team + 1 if extra else matches_per_team)
+    return bounds
+
+def _max_flow(capacity, source, sink):
+    """Return the maximum flow and the nodes still reachable from `source` in the residual graph.
+
+    `capacity` maps each node to a dict of neighbour capacities and is used up
+    as the residual graph.
+    """
+    for node in list(capacity):
+        for other in list(capacity[node]):
+            capacity.setdefault(other, {}).setdefault(node, 0)
+    flow = 0
+    while True:
+        parent = {source: None}
+        queue = deque([source])
+        while queue and sink not in parent:
+            node = queue.popleft()
+            for other, left in capacity[node].items():
+                if left > 0 and other not in parent:
+                    parent[other] = node
+                    queue.append(other)
+        if sink not in parent:
+            return flow, set(parent)
+        path = []
+        node = sink
+        while parent[node] is not None:
+            path.append((parent[node], node))
+            node = parent[node]
+        pushed = min(capacity[a][b] for a, b in path)
+        for a, b in path:
+            capacity[a][b] -= pushed
+            capacity[b][a] += pushed
+        flow += pushed
+
+def matchup_problems(teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+                     allow_more_matches, home_club):
+    """Return why no choice of matchups can meet the match counts, or an empty list.
+
+    Checks the match total (integral and, with forced concurrency, a multiple
+    of the slot size), each team's number of allowed opponents and a flow on
+    the club graph: every club must be able to place its teams' matches
+    against clubs it may play, at most one match per pair of teams. Teams of a
+    club are interchangeable, so the club flow is as strong as the same test
+    on teams. These conditions are necessary, so a tournament that passes can
+    still be infeasible, but one that fails never has a schedule.
+    """
+    if len(teams) < 2:
+        return ["Not possible: a tournament needs at least two teams."]
+    bounds = team_match_bounds(teams, matches_per_team, allow_more_matches, home_club)
+    fewest = sum(low for low, _ in bounds.values())
+    most = sum(high for _, high in bounds.values())
+    totals = range(math.ceil(fewest / 2), most // 2 + 1)
+    if not totals:
+        return [f"Not possible: {len(teams)} teams with {matches_per_team} matches each would need "
+                f"{fewest / 2} matches, which is not a whole number."]
+    problems = []
+    if force_max_concurrency and not any(total % effective_concurrency == 0 for total in totals):
+        problems.append(f"Not possible with 'Force Max Concurrency': {totals[0]} matches cannot fill slots of "
+                        f"{effective_concurrency} matches exactly.")
+
+    clubs = {}
+    for team in teams:
+        clubs.setdefault(team[0], []).append(team)
+    opponents = {club: set() for club in clubs}
+    for t1, t2 in allowed_matchups:
+        opponents[t1[0]].add(t2[0])
+        opponents[t2[0]].add(t1[0])
+    for club, club_teams in clubs.items():
+        reachable = sum(len(clubs[other]) for other in opponents[club])
+        if reachable < matches_per_team:
+            problems.append(f"Not possible: teams of club {club} can meet at most {reachable} different opponents "
+                            f"after restrictions, but each needs {matches_per_team} matches.")
+    if problems:
+        return problems
+
+    # Each club sends its fewest matches from the left copy and takes at most its
+    # most matches into the right copy; a fractional solution of the real
+    # problem gives such a flow, so a short flow rules the tournament out.
+    capacity = {'source': {}}
+    for club, club_teams in clubs.items():
+        capacity['source'][('out', club)] = sum(bounds[team][0] for team in club_teams)
+        capacity[('out', club)] = {('in', other): len(club_teams) * len(clubs[other]) for other in opponents[club]}
+        capacity[('in', club)] = {'sink': sum(bounds[team][1] for team in club_teams)}
+    demand = dict(capacity['source'])
+    flow, reachable = _max_flow(capacity, 'source', 'sink')
+    if flow < fewest:
+        # The clubs still reachable from the source are the ones the cut says cannot all be served
+        short = sorted(club for club in clubs if ('out', club) in reachable)
+        needed = sum(demand[('out', club)] for club in short)
+        problems.append(f"Not possible: club{'s' if len(short) > 1 else ''} "
+                        f"{', '.join(short)} need{'' if len(short) > 1 else 's'} {needed} matches against other clubs, but at most "
+                        f"{needed - (fewest - flow)} can be placed.")
+    return problems
+
+def _wait_blocks(matches_per_team, num_teams, effective_concurrency, slot_duration, long_break_time,
+                 long_break_frequency, max_wait_time):
+    """Return `(block_teams, needed)` when waits cannot span a long break, else None.
+
+    Each block of `long_break_frequency` slots then holds at most `block_teams`
+    teams, and `needed` is the number of slots all teams take.
+    """
+    if long_break_frequency <= 0 or slot_duration + long_break_time <= max_wait_time:
+        return None
+    block_teams = 2 * effective_concurrency * long_break_frequency // matches_per_team
+    blocks = math.ceil(num_teams / block_teams)
+    last_teams = num_teams - (blocks - 1) * block_teams
+    needed = ((blocks - 1) * long_break_frequency
+              + max(matches_per_team, math.ceil(last_teams * matches_per_team / (2 * effective_concurrency))))
+    return block_teams, needed
+
+def horizon_problems(matches_per_team, num_teams, effective_concurrency, slot_duration, long_break_time,
+                     long_break_frequency, max_wait_time, num_slots):
+    """Return why `max_wait_time` cannot be kept within `num_slots` slots, or an empty list.
+
+    A team's consecutive games are at least one slot apart. When the gap
+    across a long break is over the limit, every team has to play all its
+    games between two long breaks, so the breaks split the day into separate
+    blocks that each hold only as many teams as fit their slots.
+    """
+    if matches_per_team < 2 or effective_concurrency < 1:
+        return []
+    if slot_duration > max_wait_time:
+        return [f"Not possible: consecutive games of a team are at least {slot_duration} minutes apart, more than "
+                f"the max wait time of {max_wait_time} minutes."]
+    if (long_break_frequency > 0 and slot_duration + long_break_time > max_wait_time
+            and matches_per_team > long_break_frequency):
+        return [f"Not possible: waiting across a long break takes {slot_duration + long_break_time} minutes, more "
+                f"than the max wait time of {max_wait_time}, so each team's {matches_per_team} matches must fit "
+                f"within the {long_break_frequency} slots between long breaks."]
+    blocks = _wait_blocks(matches_per_team, num_teams, effective_concurrency, slot_duration, long_break_time,
+                          long_break_frequency, max_wait_time)
+    if blocks is not None and blocks[1] > num_slots:
+        block_teams, needed = blocks
+        return [f"Not possible: waiting across a long break exceeds the max wait time, so teams play in separate "
+                f"blocks of {long_break_frequency} slots holding at most {block_teams} teams each; that needs "
+                f"{needed} slots, more than the {num_slots} available."]
+    return []
+
+def team_slot_capacity(num_slots, long_break_time, long_break_frequency, max_consecutive_games):
+    """Return the most games one team can play in `num_slots` slots with at most `max_consecutive_games` in a row.
+
+    A long break ends a run of games, as in the schedule's timing statistics.
+    """
+    if not max_consecutive_games:
+        return num_slots
+    run = max_consecutive_games + 1
+    if long_break_frequency > 0 and long_break_time > 0:
+        blocks, rest = divmod(num_slots, long_break_frequency)
+        return blocks * (long_break_frequency - long_break_frequency // run) + rest - rest // run
+    return num_slots - num_slots // run
+
+def team_slots(matches_per_team, long_break_time, long_break_frequency, max_consecutive_games):
+    """Return the fewest slots one team's games fit in with at most `max_consecutive_games` in a row."""
+    needed = matches_per_team
+    while team_slot_capacity(needed, long_break_time, long_break_frequency, max_consecutive_games) < matches_per_team:
+        needed += 1
+    return needed
+
+def streak_problems(matches_per_team, num_teams, effective_concurrency, force_max_concurrency, slot_duration,
+                    long_break_time, long_break_frequency, max_wait_time, max_consecutive_games, num_slots):
+    """Return why no schedule within `num_slots` slots keeps to `max_consecutive_games` games in a row, or [].
+
+    Each team needs enough slots for its games with rests between runs; when
+    waits cannot span a long break those slots must lie between two long
+    breaks; and with 'Force Max Concurrency' every run of back-to-back slots
+    must leave each team a rest. `max_wait_time` may be None.
+    """
+    if not max_consecutive_games or effective_concurrency < 1:
+        return []
+    limit = max_consecutive_games
+    needed = team_slots(matches_per_team, long_break_time, long_break_frequency, limit)
+    if needed > num_slots:
+        return [f"Not possible: with at most {limit} games in a row, each team's {matches_per_team} matches need "
+                f"{needed} slots, more than the {num_slots} available."]
+    if (max_wait_time is not None and 2 <= matches_per_team <= long_break_frequency
+            and slot_duration <= max_wait_time
+            and _wait_blocks(matches_per_team, num_teams, effective_concurrency, slot_duration, long_break_time,
+                             long_break_frequency, max_wait_time) is not None):
+        capacity = team_slot_capacity(long_break_frequency, long_break_time, long_break_frequency, limit)
+        if capacity < matches_per_team:
+            return [f"Not possible: waiting across a long break exceeds the max wait time, so each team plays its "
+                    f"{matches_per_team} matches between two long breaks, but with at most {limit} games in a row "
+                    f"only {capacity} of those {long_break_frequency} slots can be used."]
+    if force_max_concurrency and 2 * effective_concurrency * (limit + 1) > num_teams * limit:
+        # Used slots come first, so the longest run of back-to-back ones is known
+        used = math.ceil(num_teams * matches_per_team / 2 / effective_concurrency)
+        if long_break_frequency > 0 and long_break_time > 0:
+            used = min(used, long_break_frequency)
+        if used > limit:
+            return [f"Not possible: with 'Force Max Concurrency' {2 * effective_concurrency} of the {num_teams} "
+                    f"teams play in every slot, so within {limit + 1} slots in a row some team plays more than "
+                    f"{limit} games in a row."]
+    return []
+
+def min_slots(matches_per_team, num_teams, effective_concurrency, slot_duration, long_break_time,
+              long_break_frequency, max_wait_time, max_consecutive_games=None):
+    """Return a lower bound on the slots any schedule of the tournament takes.
+
+    The rinks hold `effective_concurrency` games per slot, a team plays at
+    most once per slot and rests after `max_consecutive_games` in a row, and
+    waits that cannot span a long break split the day into blocks (see
+    `horizon_problems`). `max_wait_time` and `max_consecutive_games` may be None.
+    """
+    if effective_concurrency < 1:
+        return 0
+    needed = max(1, math.ceil(math.ceil(num_teams * matches_per_team / 2) / effective_concurrency),
+                 team_slots(matches_per_team, long_break_time, long_break_frequency, max_consecutive_games))
+    if (max_wait_time is not None and 2 <= matches_per_team <= long_break_frequency
+            and slot_duration <= max_wait_time):
+        blocks = _wait_blocks(matches_per_team, num_teams, effective_concurrency, slot_duration, long_break_time,
+                              long_break_frequency, max_wait_time)
+        if blocks is not None:
+            needed = max(needed, blocks[1])
+    return needed
@@ -0,0 +1,186 @@
+import copy
+import math
+import time
+
+from app.utils import (format_time, horizon_slots, resolve_solver_profile, slot_offsets, solve_slot_assignments,
+                       summarize_schedule, tournament_matchups)
+
+# Delta types understood by apply_delta
+DELTA_TYPES = ('remove_team', 'add_team', 'add_restriction', 'concurrency')
+
+# How many times the freed neighbourhood grows before falling back to a full solve
+MAX_REPAIR_ROUNDS = 3
+
+# Seconds a repair may take in all when the solver profile sets no time limit
+REPAIR_TIME_LIMIT = 30
+
+def apply_delta(params, delta, max_concurrency=None):
+    """Return a copy of the `generate_and_schedule_matchups` arguments with the change applied.
+
+    `delta` is a dict with a 'type' from DELTA_TYPES:
+    {'type': 'remove_team', 'club': ..., 'team': ...},
+    {'type': 'add_team', 'club': ...} (adds the club's next numbered team, creating the club if needed),
+    {'type': 'add_restriction', 'clubs': [club1, club2]},
+    {'type': 'concurrency', 'concurrency': ...}, capped at `max_concurrency` when given.
+    """
+    params = copy.deepcopy(params)
+    kind = delta.get('type')
+    if kind == 'remove_team':
+        teams = params['clubs'].get(delta['club'], [])
+        if delta['team'] not in teams:
+            raise ValueError(f"Unknown team {delta['team']} in club {delta['club']}.")
+        teams.remove(delta['team'])
+        if not teams:
+            del params['clubs'][delta['club']]
+    elif kind == 'add_team':
+        teams = params['clubs'].setdefault(delta['club'], [])
+        teams.append(f"{delta['club']}{len(teams) + 1}")
+    elif kind == 'add_restriction':
+        club1, club2 = delta['clubs']
+        if club1 == club2:
+            raise ValueError("A restriction needs two different clubs.")
+        params['restricted_clubs'] = set(params['restricted_clubs'] or set()) | {(club1, club2)}
+    elif kind == 'concurrency':
+        params['concurrency'] = int(delta['concurrency'])
+        if max_concurrency is not None:
+            params['concurrency'] = min(params['concurrency'], max_concurrency)
+    else:
+        raise ValueError(f"Unknown change type {kind!r}; expected one of {', '.join(DELTA_TYPES)}.")
+    return params
+
+def schedule_slots(schedule, start_time, slot_duration, long_break_time, long_break_frequency):
+    """Return the slot index of each entry of a schedule list, recovered from its start time.
+
+    Empty slots are left out of schedule lists, so list positions are not slot
+    indices. Raises ValueError for a time that is not the start of a slot
+    (see `slot_offsets`).
+    """
+    if not schedule:
+        return []
+    last = (schedule[-1][0] - start_time).total_seconds() / 60
+    index = {offset: slot for slot, offset in
+             enumerate(slot_offsets(max(0, int(last // slot_duration)) + 1, slot_duration, long_break_time,
+                                    long_break_frequency))}
+    slots = []
+    for match_time, _ in schedule:
+        slot = index.get((match_time - start_time).total_seconds() / 60)
+        if slot is None:
+            raise ValueError(f"{format_time(match_time)} is not the start of a slot with these settings.")
+        slots.append(slot)
+    return slots
+
+def repair_schedule(params, previous_schedule, delta, solve=None, max_concurrency=None):
+    """Re-solve a generated schedule after a change, keeping untouched games in their slots.
+
+    `params` are the `generate_and_schedule_matchups` arguments the previous
+    schedule was generated with and `previous_schedule` is its schedule list.
+    Games that are no longer allowed are dropped, and the games over the new
+    concurrency, a few games a new team can take over and, with more
+    concurrency, the games past the fewest slots it needs are freed. Everything
+    else stays fixed while CP-SAT places the games teams are missing (see
+    `solve_around_fixed`), first within the old number of slots and then with
+    more. If that is infeasible, the games of the teams involved are freed as
+    well, one ring of opponents per round, and after MAX_REPAIR_ROUNDS a hinted
+    full solve is used. The rounds share half of the profile's time limit, or
+    REPAIR_TIME_LIMIT, and the full solve gets the rest. Returns the same tuple
+    as `generate_and_schedule_matchups`. `solve` replaces
+    `solve_slot_assignments`, as in `generate_and_schedule_matchups`, and
+    `max_concurrency` caps a new concurrency (see `apply_delta`).
+    """
+    solve = solve or solve_slot_assignments
+    new_params = apply_delta(params, delta, max_concurrency)
+    restricted_clubs = new_params['restricted_clubs'] or set()
+    teams, allowed_matchups = tournament_matchups(new_params['clubs'], restricted_clubs)
+    allowed = set(allowed_matchups)
+    rank = {team: i for i, team in enumerate(teams)}
+
+    # Carry the old schedule over, dropping matchups that are no longer allowed
+    slot_duration = params['game_time'] + (params['break_time'] if params['spread_games'] else 0)
+    slots = schedule_slots(previous_schedule, params['start_time'], slot_duration, params['long_break_time'],
+                           params['long_break_frequency'])
+    previous = {slot: [] for slot in range(slots[-1] + 1 if slots else 0)}
+    affected = set()
+    for slot, (_, matchups) in zip(slots, previous_schedule):
+        for matchup in matchups:
+            matchup = tuple(sorted(matchup, key=lambda team: rank.get(team, -1)))
+            if matchup in allowed:
+                previous[slot].append(matchup)
+            else:
+                affected.update(team for team in matchup if team in rank)
+
+    effective_concurrency = min(new_params['concurrency'], len(teams) // 2)
+    total_required_matches = len(teams) * new_params['matches_per_team'] / 2
+    # Over-full slots give up their last games
+    freed = {(matchup, slot) for slot, matchups in previous.items() for matchup in matchups[effective_concurrency:]}
+    # A new team takes over opponents from games between teams it may play, in the emptiest slots first
+    if delta['type'] == 'add_team':
+        new_team = (delta['club'], new_params['clubs'][delta['club']][-1])
+        affected.add(new_team)
+        opponents = {team for matchup in allowed_matchups if new_team in matchup for team in matchup} - {new_team}
+        taken = set()
+        for slot in sorted(previous, key=lambda slot: len(previous[slot])):
+            for matchup in previous[slot]:
+                if len(taken) < new_params['matches_per_team'] and set(matchup) <= opponents and not taken & set(matchup):
+                    freed.add((matchup, slot))
+                    taken.update(matchup)
+    # With more concurrency, only games past the fewest slots it needs can move forward
+    if delta['type'] == 'concurrency' and new_params['concurrency'] > params['concurrency']:
+        shortest = math.ceil(sum(len(matchups) for matchups in previous.values()) / effective_concurrency)
+        freed |= {(matchup, slot) for slot, matchups in previous.items() if slot >= shortest for matchup in matchups}
+
+    settings = {key: new_params[key] for key in ('matches_per_team', 'concurrency', 'game_time', 'break_time',
+                                                 'spread_games', 'force_max_concurrency', 'allow_more_matches',
+                                                 'home_club', 'long_break_time', 'long_break_frequency',
+                                                 'max_wait_time', 'max_consecutive_games', 'max_rest_games')}
+    profile = resolve_solver_profile(new_params.get('solver_profile'))
+    budget = profile['time_limit'] if profile['time_limit'] is not None else REPAIR_TIME_LIMIT
+    deadline = time.monotonic() + budget
+    rounds_deadline = deadline - budget / 2
+    # The old number of slots first, then as many as a full solve offers
+    tight = max(len(previous), math.ceil(total_required_matches / effective_concurrency))
+    horizons = (tight, max(horizon_slots(total_required_matches, effective_concurrency), tight + 1))
+
+    slot_assignments = None
+    for _ in range(MAX_REPAIR_ROUNDS):
+        fixed = {slot: [matchup for matchup in matchups if (matchup, slot) not in freed]
+                 for slot, matchups in previous.items()}
+        for num_slots in horizons:
+            time_limit = max(0.0, rounds_deadline - time.monotonic()) / 2
+            slot_assignments, notes, status = solve(
+                teams, allowed_matchups, strategy='cp', solver_profile=dict(profile, time_limit=time_limit),
+                hint=previous, fixed=fixed, num_slots=num_slots, **settings
+            )
+            if slot_assignments is not None or status == 'REJECTED':
+                break
+        if status == 'REJECTED':
+            return [], notes, {}, {}, {}, teams
+        if slot_assignments is not None:
+            kept = sum(len(matchups) for matchups in fixed.values())
+            total = sum(len(matchups) for matchups in slot_assignments.values())
+            notes.insert(0, f"Repaired schedule: re-planned {total - kept} of {total} games, "
+                            f"kept {kept} in their slots.")
+            break
+        # Free the games of every team involved, so their opponents can be paired anew
+        affected |= {team for matchup, _ in freed for team in matchup}
+        grown = freed | {(matchup, slot) for slot, matchups in previous.items() for matchup in matchups
+                         if affected & set(matchup)}
+        if grown == freed:
+            break
+        freed = grown
+
+    if slot_assignments is None:
+        slot_assignments, notes, status = solve(
+            teams, allowed_matchups, strategy='cp',
+            solver_profile=dict(profile, time_limit=max(0.0, deadline - time.monotonic())), hint=previous, **settings
+        )
+        if slot_assignments is None:
+            return [], notes, {}, {}, {}, teams
+        notes.insert(0, "The change could not be repaired locally; the whole schedule was re-planned.")
+
+    result = summarize_schedule(slot_assignments, teams, new_params['matches_per_team'], new_params['concurrency'],
+                                new_params['game_time'], new_params['break_time'], new_params['spread_games'],
+                                new_params['start_time'], new_params['force_max_concurrency'],
+                                new_params['allow_more_matches'], new_params['home_club'], restricted_clubs,
+                                new_params['long_break_time'], new_params['long_break_frequency'])
+    result[1][:0] = notes
+    return result
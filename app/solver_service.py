@@ -0,0 +1,253 @@
+"""A long-lived solver process that the web workers hand their solves to.
+
+Loading OR-Tools takes a good part of a second, and previews and the form never
+need it. Web workers therefore only build matchups, look up the result cache
+and summarize schedules; `solve_slot_assignments` runs in a solver process that
+loads OR-Tools and solves a trivial model once when it starts. Each solve is
+one `multiprocessing.connection` connection to it, over a local socket.
+
+Without an address every web process starts its own solver process. To share
+one between all web workers, run
+
+    FLASK_SOLVER_SERVICE_AUTHKEY=<key> python run_solver.py /run/scheduler/solver.sock
+
+and start the web workers with the same key and FLASK_SOLVER_SERVICE_ADDRESS.
+"""
+import argparse
+import atexit
+import multiprocessing
+import os
+import secrets
+import threading
+from multiprocessing.connection import Client, Listener
+
+from flask import current_app
+
+from app.metrics import metrics
+
+# Seconds to wait for a solver process to load OR-Tools and start listening
+START_TIMEOUT = 60
+
+_service_lock = threading.Lock()
+
+class SolverUnavailableError(Exception):
+    """Raised when the solver process cannot be started or reached."""
+
+def parse_address(address):
+    """Return a listener address: `host:port` is a TCP socket, anything else a Unix socket path or named pipe."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return host, int(port)
+    return address
+
+def _handle(conn):
+    """Run one request on its own connection and send the result back, with its metrics trace."""
+    from app.utils import solve_slot_assignments
+
+    try:
+        _, (args, kwargs, stream) = conn.recv()
+        if stream:
+            def on_assignments(slot_assignments, entry):
+                try:
+                    conn.send(('solution', (slot_assignments, entry)))
+                except OSError:
+                    pass  # The web worker went away; finish the solve quietly
+
+            kwargs['on_assignments'] = on_assignments
+        metrics.begin('solve')
+        try:
+            reply = ('done', (solve_slot_assignments(*args, **kwargs), metrics.take()))
+        except Exception as exc:
+            metrics.take()
+            reply = ('error', exc)
+        try:
+            conn.send(reply)
+        except Exception:
+            # The exception could not be pickled; report it as text
+            conn.send(('error', RuntimeError(f"{type(reply[1]).__name__}: {reply[1]}")))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+def serve(listener, on_ready=None):
+    """Warm up, then answer requests on `listener`, each in its own thread, until the process exits.
+
+    `on_ready` is called once OR-Tools is loaded and the first solve would not
+    pay for it.
+    """
+    from app.cpsat import warm_up
+    # Load the whole solve path now rather than on the first request
+    import app.lns  # noqa: F401
+    import app.utils  # noqa: F401
+
+    warm_up()
+    if on_ready is not None:
+        on_ready()
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError, multiprocessing.AuthenticationError):
+            continue
+        threading.Thread(target=_handle, args=(conn,), name='solver-request', daemon=True).start()
+
+def _run_local(ready, authkey):
+    """Serve one web process, sending it the listener address once warm and exiting when it closes `ready`."""
+    listener = Listener(authkey=authkey)
+
+    def stop():
+        listener.close()
+        os._exit(0)
+
+    def watch_parent():
+        try:
+            ready.recv()
+        except (EOFError, OSError):
+            pass
+        stop()
+
+    def on_ready():
+        try:
+            ready.send(listener.address)
+        except OSError:
+            stop()  # The web process exited while this one was starting
+        threading.Thread(target=watch_parent, name='solver-parent', daemon=True).start()
+
+    serve(listener, on_ready)
+
+class SolverService:
+    """Run `solve_slot_assignments` in a long-lived, pre-warmed solver process.
+
+    With an `address`, solves go to a service started with `run_solver.py`
+    under the same `authkey`. Without one, this web process starts its own
+    solver process on `start` or the first solve, and starts it again when it
+    has died. Every solve is its own connection, so concurrent requests are
+    solved in parallel.
+    """
+
+    def __init__(self, address=None, authkey=None, start_timeout=START_TIMEOUT):
+        self.address = address
+        self.external = address is not None
+        self.authkey = authkey or secrets.token_bytes(32)
+        self.start_timeout = start_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._process = None
+        self._ready = None
+        # Runs before multiprocessing's own exit handler, which would wait for the process forever
+        atexit.register(self.shutdown)
+
+    def start(self):
+        """Start the local solver process unless it is running; does not wait for it to warm up."""
+        if self.external:
+            return
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            if self._ready is not None:
+                self._ready.close()
+            self._ready, child_conn = self._context.Pipe()
+            # Not a daemon: large-neighbourhood search starts processes of its own
+            self._process = self._context.Process(target=_run_local, args=(child_conn, self.authkey),
+                                                  name='solver-service')
+            try:
+                self._process.start()
+            finally:
+                child_conn.close()
+            self.address = None
+
+    def solve(self, *args, on_assignments=None, **kwargs):
+        """Return `solve_slot_assignments(*args, **kwargs)`, computed in the solver process.
+
+        Improving solutions are passed to `on_assignments` as they arrive, and
+        the solve's phase timings and solver statistics are added to this
+        thread's metrics trace. Exceptions raised by the solve are raised here.
+        Raises SolverUnavailableError when the solver process cannot be
+        reached or exits during the solve.
+        """
+        for attempt in range(2):
+            try:
+                conn = Client(self._address(), authkey=self.authkey)
+                break
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as exc:
+                if self.external or attempt:
+                    raise SolverUnavailableError(f"Cannot reach the solver service: {exc}") from exc
+                # A local solver process that died is started again
+                self.start()
+        with conn:
+            try:
+                conn.send(('solve', (args, kwargs, on_assignments is not None)))
+                kind, payload = conn.recv()
+                while kind == 'solution':
+                    on_assignments(*payload)
+                    kind, payload = conn.recv()
+            except (EOFError, OSError) as exc:
+                raise SolverUnavailableError("The solver process exited during the solve.") from exc
+        if kind == 'error':
+            raise payload
+        result, trace = payload
+        metrics.merge(trace)
+        return result
+
+    def shutdown(self):
+        """Stop the local solver process."""
+        with self._lock:
+            if self._process is None:
+                return
+            self._ready.close()
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._process = None
+
+    def _address(self):
+        if self.external:
+            return self.address
+        self.start()
+        with self._lock:
+            if self.address is None:
+                if not self._ready.poll(self.start_timeout):
+                    raise SolverUnavailableError(f"The solver process did not start within {self.start_timeout}s.")
+                try:
+                    self.address = self._ready.recv()
+                except (EOFError, OSError) as exc:
+                    self._process.join(1)
+                    raise SolverUnavailableError(
+                        f"The solver process exited with code {self._process.exitcode}.") from exc
+            return self.address
+
+def get_solver_service():
+    """Return the application's solver service, creating it on first use."""
+    with _service_lock:
+        service = current_app.extensions.get('solver_service')
+        if service is None:
+            address = current_app.config['SOLVER_SERVICE_ADDRESS']
+            authkey = current_app.config['SOLVER_SERVICE_AUTHKEY']
+            if address and not authkey:
+                raise RuntimeError("FLASK_SOLVER_SERVICE_AUTHKEY must be set to the solver service's key "
+                                   "when FLASK_SOLVER_SERVICE_ADDRESS is.")
+            service = SolverService(parse_address(str(address)) if address else None,
+                                    str(authkey).encode() if authkey else None)
+            current_app.extensions['solver_service'] = service
+        return service
+
+def main():
+    """Run the solver service on the address given on the command line or in the config."""
+    parser = argparse.ArgumentParser(description="Run a solver service shared by the scheduler's web workers.")
+    parser.add_argument('address', nargs='?',
+                        help="Unix socket path or host:port to listen on (default FLASK_SOLVER_SERVICE_ADDRESS)")
+    args = parser.parse_args()
+
+    from app import app as flask_app
+    address = args.address or flask_app.config['SOLVER_SERVICE_ADDRESS']
+    authkey = flask_app.config['SOLVER_SERVICE_AUTHKEY']
+    if not address:
+        parser.error("give an address or set FLASK_SOLVER_SERVICE_ADDRESS")
+    if not authkey:
+        parser.error("set FLASK_SOLVER_SERVICE_AUTHKEY to the key the web workers use")
+    listener = Listener(parse_address(str(address)), authkey=str(authkey).encode())
+    try:
+        serve(listener, lambda: print(f"Solver service ready on {listener.address}", flush=True))
+    finally:
+        listener.close()
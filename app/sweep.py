@@ -0,0 +1,134 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from flask import current_app
+
+from app.analytics import analyze_schedule
+from app.cache import ResultCache
+from app.jobs import DONE, FAILED, TIMED_OUT
+from app.utils import format_time, generate_and_schedule_matchups
+
+# Seconds a variant may overrun its solver time limit before it is reported as timed out
+SWEEP_GRACE = 10
+
+_sweep_lock = threading.Lock()
+
+def _warm_up():
+    """Load and exercise OR-Tools once when a pool worker starts, so variants do not pay for it."""
+    from app.cpsat import warm_up
+    warm_up()
+
+def _ready():
+    return True
+
+def summarize_result(result, params):
+    """Reduce a `generate_and_schedule_matchups` result to the figures compared across variants."""
+    schedule, warnings, _, _, _, teams = result
+    slot_duration = params['game_time'] + (params['break_time'] if params['spread_games'] else 0)
+    analysis = analyze_schedule(schedule, teams, slot_duration, min(params['concurrency'], len(teams) // 2),
+                                params['game_time'], params['long_break_time'], params['long_break_frequency'])
+    averages = analysis['averages']
+    return {
+        'slots_used': len(schedule),
+        'end_time': format_time(schedule[-1][0] + timedelta(minutes=params['game_time'])) if schedule else None,
+        'avg_min_wait': averages['min_time_between'],
+        'avg_max_wait': averages['max_time_between'],
+        'avg_median_wait': averages['median_time_between'],
+        'max_consecutive_games': int(analysis['team']['max_consecutive'].max()) if teams else None,
+        'wait_percentiles': analysis['wait_percentiles'],
+        'rink_utilization': analysis['utilization']['slot_utilization'],
+        'club_wait_spread': analysis['clubs']['wait_spread'],
+        'warnings': warnings
+    }
+
+def solve_variant(params, cache_path=None):
+    """Solve one variant in a pool worker and return its summary."""
+    cache = ResultCache(max_entries=0, path=cache_path) if cache_path else None
+    result = generate_and_schedule_matchups(cache=cache, **params)
+    return summarize_result(result, params)
+
+class SweepRunner:
+    """Solve batches of tournament variants on a process pool kept for the app's lifetime.
+
+    Workers are started and warmed up when the runner is created, so OR-Tools
+    is loaded once per worker rather than once per variant. Variants of a batch
+    run in parallel, up to `max_workers` at a time.
+    """
+
+    def __init__(self, max_workers=2, time_limit=60, cache_path=None):
+        self.max_workers = max_workers
+        self.time_limit = time_limit
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def run(self, variants):
+        """Solve each `generate_and_schedule_matchups` keyword-argument dict in `variants`.
+
+        Each variant's solver time limit is capped at `time_limit`. Returns one
+        entry per variant, in order: its summary with status 'done', or status
+        'failed' / 'timed_out' with an error message.
+        """
+        tasks = []
+        for params in variants:
+            profile = dict(params.get('solver_profile') or {})
+            if profile.get('time_limit') is None or profile['time_limit'] > self.time_limit:
+                profile['time_limit'] = self.time_limit
+            tasks.append(dict(params, solver_profile=profile))
+        with self._lock:
+            executor = self._executor
+        futures = [executor.submit(solve_variant, params, self.cache_path) for params in tasks]
+        # Variants beyond the first max_workers queue behind the others
+        rounds = -(-len(tasks) // self.max_workers)
+        longest = max(params['solver_profile']['time_limit'] for params in tasks)
+        done, _ = wait(futures, timeout=rounds * (longest + SWEEP_GRACE))
+        results = []
+        for params, future in zip(tasks, futures):
+            if future not in done:
+                future.cancel()
+                results.append({'status': TIMED_OUT,
+                                'error': f"No result within {params['solver_profile']['time_limit']}s."})
+                continue
+            try:
+                results.append(dict(future.result(), status=DONE))
+            except BrokenProcessPool:
+                self._restart(executor)
+                results.append({'status': FAILED, 'error': "A solver worker exited unexpectedly."})
+            except Exception as exc:
+                results.append({'status': FAILED, 'error': f"{type(exc).__name__}: {exc}"})
+        return results
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            self._executor.shutdown(wait=False)
+
+    def _start(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'), initializer=_warm_up
+        )
+        # Start every worker now rather than on the first sweep
+        for _ in range(self.max_workers):
+            executor.submit(_ready)
+        return executor
+
+    def _restart(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = self._start()
+
+def get_sweep_runner():
+    """Return the application's sweep runner, creating it on first use."""
+    with _sweep_lock:
+        runner = current_app.extensions.get('sweep_runner')
+        if runner is None:
+            runner = SweepRunner(
+                max_workers=current_app.config['SWEEP_MAX_WORKERS'],
+                time_limit=current_app.config['SWEEP_TIME_LIMIT'],
+                cache_path=current_app.config['RESULT_CACHE_PATH']
+            )
+            current_app.extensions['sweep_runner'] = runner
+        return runner
@@ -1,8 +1,14 @@
+from collections import Counter
 from datetime import datetime, timedelta
 import itertools
 import math
-from ortools.sat.python import cp_model
-import statistics
+import os
+from app.analytics import analyze_schedule, team_statistics
+from app.cache import canonical_key
+from app.heuristic import construct_schedule
+from app.metrics import metrics
+from app.precheck import horizon_problems, matchup_problems, min_slots, streak_problems
+import time
 
 def parse_time(time_str):
     """Parse a time string in HH:MM format into a datetime object."""
@@ -12,20 +18,184 @@ def format_time(dt):
     """Format a datetime object into a HH:MM string."""
     return dt.strftime("%H:%M")
 
-def calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches):
-    """Calculate feasibility and statistics for the tournament."""
+# How generate_and_schedule_matchups builds a schedule: full CP-SAT optimization,
+# the constructive heuristic alone, the heuristic as a starting point for CP-SAT,
+# or the heuristic improved by large-neighbourhood search for big tournaments.
+# Any other value of game_scheduling_strategy is treated as 'cp'.
+SCHEDULING_STRATEGIES = ('cp', 'heuristic', 'heuristic+cp', 'lns')
+
+SOLVER_PROFILE_DEFAULTS = {
+    'time_limit': None,     # seconds of wall time before the best solution so far is returned
+    'num_workers': None,    # parallel search workers; None uses the CP-SAT default
+    'relative_gap': None,   # stop once the objective is proven within this fraction of optimal
+    'random_seed': None,
+    'lns_window_size': 4,       # consecutive slots freed per window neighbourhood
+    'lns_club_count': 2,        # clubs freed per club neighbourhood
+    'lns_sub_time_limit': 5,    # seconds per neighbourhood re-solve
+    'lns_max_stale': 10,        # iterations without improvement before the search stops
+    'symmetry_breaking': 'slots'    # order interchangeable teams by 'slots' or 'opponents', or False for off
+}
+
+# Patterns interchangeable teams can be ordered by (see solve_slot_assignments)
+SYMMETRY_BREAKING = ('slots', 'opponents')
+
+# Relative gap a re-plan around fixed games stops at when the solver profile sets
+# none; a slot costs 1000 in the objective, so it still finds the shortest schedule
+FIXED_RELATIVE_GAP = 0.01
+
+# Part of the result cache key; raised whenever the model changes which schedules
+# it accepts or what is cached, so results cached by an older version are solved again
+MODEL_VERSION = 4
+
+def resolve_solver_profile(solver_profile=None):
+    """Return the solver profile with unset entries filled in from SOLVER_PROFILE_DEFAULTS."""
+    unknown = set(solver_profile or {}) - set(SOLVER_PROFILE_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown solver profile settings: {', '.join(sorted(unknown))}")
+    profile = dict(SOLVER_PROFILE_DEFAULTS, **{key: value for key, value in (solver_profile or {}).items()
+                                               if value is not None})
+    if profile['symmetry_breaking'] is True:
+        profile['symmetry_breaking'] = SYMMETRY_BREAKING[0]
+    if profile['symmetry_breaking'] not in SYMMETRY_BREAKING + (False,):
+        raise ValueError(f"Unknown symmetry breaking {profile['symmetry_breaking']!r}; "
+                         f"expected one of {', '.join(SYMMETRY_BREAKING)}")
+    return profile
+
+def configure_solver(solver, solver_profile=None):
+    """Apply a solver profile on top of SOLVER_PROFILE_DEFAULTS to a CP-SAT solver."""
+    profile = resolve_solver_profile(solver_profile)
+    if profile['time_limit'] is not None:
+        solver.parameters.max_time_in_seconds = float(profile['time_limit'])
+    if profile['num_workers'] is not None:
+        solver.parameters.num_search_workers = int(profile['num_workers'])
+    if profile['relative_gap'] is not None:
+        solver.parameters.relative_gap_limit = float(profile['relative_gap'])
+    if profile['random_seed'] is not None:
+        solver.parameters.random_seed = int(profile['random_seed'])
+    return profile
+
+def horizon_slots(total_required_matches, effective_concurrency):
+    """Return the most slots the scheduling model offers."""
+    return math.ceil(total_required_matches / effective_concurrency) + 4
+
+def horizon_steps(lower, upper, extra=0):
+    """Yield the horizons to try from `lower` up to `upper`: the tightest two, then the largest.
+
+    Proving a horizon infeasible costs most near `upper`, so after one extra
+    slot the search goes straight to the largest horizon, and then to
+    `upper + extra` when `extra` is given.
+    """
+    yield from range(lower, min(lower + 2, upper))
+    yield upper
+    if extra:
+        yield upper + extra
+
+def tournament_matchups(clubs, restricted_clubs):
+    """Return the tournament's teams and the matchups allowed between them."""
     teams = [(club, team) for club, teams in clubs.items() for team in teams]
     all_possible_matchups = [(t1, t2) for t1, t2 in itertools.combinations(teams, 2) if t1[0] != t2[0]]
+    allowed_matchups = [m for m in all_possible_matchups if not ((m[0][0], m[1][0]) in restricted_clubs or (m[1][0], m[0][0]) in restricted_clubs)]
+    return teams, allowed_matchups
+
+def interchangeable_teams(teams, allowed_matchups, home_club):
+    """Group teams that can swap places in any schedule: same club, home status and allowed opponents.
+
+    Returns the groups of two or more teams, each in `teams` order.
+    """
+    opponents = {team: set() for team in teams}
+    for t1, t2 in allowed_matchups:
+        opponents[t1].add(t2[0])
+        opponents[t2].add(t1[0])
+    groups = {}
+    for team in teams:
+        key = (team[0], team[0] == home_club, frozenset(opponents[team]))
+        groups.setdefault(key, []).append(team)
+    return [group for group in groups.values() if len(group) > 1]
+
+def order_interchangeable(slot_assignments, groups, allowed_matchups, key='slots'):
+    """Relabel teams within each group into the order the symmetry-breaking constraints keep.
+
+    With key 'opponents' earlier teams have the lexicographically larger row of
+    opponents played, in `allowed_matchups` order; with 'slots' earlier teams
+    start no later. Renaming one group reorders the opponent rows of the
+    others, so groups are re-sorted one at a time until nothing moves. Each
+    rename makes the schedule lexicographically larger, so this ends. Keeps a
+    schedule usable as a hint.
+    """
+    allowed = set(allowed_matchups)
+    opponents = {group[0]: team_opponents_order(group[0], allowed_matchups) for group in groups}
+    moved = True
+    while moved:
+        moved = False
+        for group in groups:
+            first_slot = {}
+            played = {}
+            for slot in sorted(slot_assignments):
+                for t1, t2 in slot_assignments[slot]:
+                    for team, opponent in ((t1, t2), (t2, t1)):
+                        first_slot.setdefault(team, slot)
+                        played.setdefault(team, set()).add(opponent)
+            if key == 'slots':
+                ranked = sorted(group, key=lambda team: first_slot.get(team, len(slot_assignments)))
+            else:
+                ranked = sorted(group, key=lambda team: [o in played.get(team, ()) for o in opponents[group[0]]],
+                                reverse=True)
+            rename = {old: new for old, new in zip(ranked, group) if old != new}
+            if not rename:
+                continue
+            moved = True
+            relabeled = {}
+            for slot, matchups in slot_assignments.items():
+                relabeled[slot] = []
+                for t1, t2 in matchups:
+                    matchup = (rename.get(t1, t1), rename.get(t2, t2))
+                    relabeled[slot].append(matchup if matchup in allowed else matchup[::-1])
+            slot_assignments = relabeled
+    return slot_assignments
+
+def team_opponents_order(team, allowed_matchups):
+    """Return the teams `team` may play, in the order they appear in `allowed_matchups`."""
+    return [t2 if t1 == team else t1 for t1, t2 in allowed_matchups if team in (t1, t2)]
+
+def slot_offsets(num_slots, slot_duration, long_break_time, long_break_frequency):
+    """Return the start of each slot in minutes from the first slot, long breaks included."""
+    return [slot * slot_duration + (slot // long_break_frequency * long_break_time if long_break_frequency > 0 else 0)
+            for slot in range(num_slots)]
+
+def calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches, home_club='',
+                         restricted_clubs=None, game_time=None, break_time=0, spread_games=False, long_break_time=0,
+                         long_break_frequency=0, max_wait_time=None, max_consecutive_games=None):
+    """Calculate feasibility and statistics for the tournament.
+
+    Feasibility uses the pre-checks in `app.precheck`; the wait-time check only
+    runs when `game_time` and `max_wait_time` are given, the consecutive-games
+    check when `max_consecutive_games` is.
+    """
+    teams, allowed_matchups = tournament_matchups(clubs, restricted_clubs or set())
 
     total_teams = len(teams)
-    total_possible_matchups = len(all_possible_matchups)
+    total_possible_matchups = len(allowed_matchups)
     total_required_matches = total_teams * matches_per_team / 2
     max_possible_concurrency = total_teams // 2
     effective_concurrency = min(concurrency, max_possible_concurrency)
-    min_slots_needed = math.ceil(total_required_matches / effective_concurrency)
-
+    slot_duration = game_time + (break_time if spread_games else 0) if game_time is not None else None
+    if slot_duration is None:
+        max_wait_time = None
+    min_slots_needed = min_slots(matches_per_team, total_teams, effective_concurrency, slot_duration, long_break_time,
+                                 long_break_frequency, max_wait_time, max_consecutive_games)
+    num_slots = horizon_slots(total_required_matches, effective_concurrency) if effective_concurrency else 0
+
+    problems = matchup_problems(teams, allowed_matchups, matches_per_team, effective_concurrency,
+                                force_max_concurrency, allow_more_matches, home_club)
+    if not problems and max_wait_time is not None:
+        problems = horizon_problems(matches_per_team, total_teams, effective_concurrency, slot_duration,
+                                    long_break_time, long_break_frequency, max_wait_time, num_slots)
+    if not problems:
+        problems = streak_problems(matches_per_team, total_teams, effective_concurrency, force_max_concurrency,
+                                   slot_duration, long_break_time, long_break_frequency, max_wait_time,
+                                   max_consecutive_games, num_slots)
     is_integer_matches = total_required_matches.is_integer()
-    is_feasible = (allow_more_matches or is_integer_matches) and total_required_matches <= total_possible_matchups
+    is_feasible = not problems
 
     concurrency_message = ""
     if concurrency > max_possible_concurrency:
@@ -38,12 +208,12 @@ def calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurr
 
     feasibility_message = "Possible" if is_feasible else (
         f"Not possible: Total matches ({total_required_matches}) must be an integer unless 'Allow More Matches' is enabled."
-        if not is_integer_matches else f"Not possible with exactly {matches_per_team} matches per team."
+        if not is_integer_matches and not allow_more_matches else " ".join(problems)
     )
 
     suggestion = ""
     if not is_feasible:
-        if not is_integer_matches:
+        if not is_integer_matches and not allow_more_matches:
             lower_matches = math.floor(total_required_matches) * 2 / total_teams
             upper_matches = math.ceil(total_required_matches) * 2 / total_teams
             suggestion = f"Enable 'Allow More Matches' or adjust matches per team to {int(lower_matches)} or {int(upper_matches)} for an integer total."
@@ -57,6 +227,7 @@ def calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurr
         'min_slots_needed': min_slots_needed,
         'is_feasible': is_feasible,
         'feasibility_message': feasibility_message,
+        'problems': problems,
         'suggestion': suggestion,
         'concurrency_message': concurrency_message
     }
@@ -64,251 +235,568 @@ def calculate_statistics(clubs, matches_per_team, concurrency, force_max_concurr
 def generate_and_schedule_matchups(clubs, matches_per_team, concurrency, game_time, break_time, spread_games, start_time,
                                    force_max_concurrency, allow_more_matches, home_club, restricted_clubs,
                                    long_break_time, long_break_frequency, game_scheduling_strategy,
-                                   max_consecutive_games, max_rest_games, max_wait_time):
-    """Generate and schedule tournament matchups using constraint programming."""
+                                   max_consecutive_games, max_rest_games, max_wait_time, solver_profile=None,
+                                   on_solution=None, cache=None, solve=None):
+    """Generate and schedule tournament matchups using constraint programming.
+
+    `game_scheduling_strategy` selects one of SCHEDULING_STRATEGIES; when the
+    heuristic fails, CP-SAT is used instead. `solver_profile` tunes the search
+    (see `configure_solver`). `on_solution`, if given, is called with the result
+    tuple and its objective/timing for every improving solution found during
+    the search. With a `ResultCache`, identical or relabeled tournaments reuse
+    an earlier solve. `solve` replaces `solve_slot_assignments` for the search
+    itself, e.g. `SolverService.solve` to run it in the solver process.
+    """
     if restricted_clubs is None:
         restricted_clubs = set()
 
-    teams = [(club, team) for club, teams in clubs.items() for team in teams]
-    all_possible_matchups = [(t1, t2) for t1, t2 in itertools.combinations(teams, 2) if t1[0] != t2[0]]
-    allowed_matchups = [m for m in all_possible_matchups if not ((m[0][0], m[1][0]) in restricted_clubs or (m[1][0], m[0][0]) in restricted_clubs)]
-
+    clock = metrics.stopwatch()
+    teams, allowed_matchups = tournament_matchups(clubs, restricted_clubs)
+    strategy = game_scheduling_strategy if game_scheduling_strategy in SCHEDULING_STRATEGIES else 'cp'
+    metrics.annotate(teams=len(teams), matchups=len(allowed_matchups), strategy=strategy)
+    clock.lap('matchups')
+
+    def summarize(slot_assignments):
+        return summarize_schedule(slot_assignments, teams, matches_per_team, concurrency, game_time, break_time,
+                                  spread_games, start_time, force_max_concurrency, allow_more_matches, home_club,
+                                  restricted_clubs, long_break_time, long_break_frequency)
+
+    cached = None
+    if cache is not None:
+        key, club_order = canonical_key(
+            clubs, home_club, restricted_clubs,
+            matches_per_team=matches_per_team, concurrency=concurrency, game_time=game_time,
+            break_time=break_time, spread_games=spread_games, start_time=format_time(start_time),
+            force_max_concurrency=force_max_concurrency, allow_more_matches=allow_more_matches,
+            long_break_time=long_break_time, long_break_frequency=long_break_frequency, strategy=strategy,
+            max_consecutive_games=max_consecutive_games, max_rest_games=max_rest_games,
+            max_wait_time=max_wait_time, solver_profile=dict(SOLVER_PROFILE_DEFAULTS, **(solver_profile or {})),
+            model_version=MODEL_VERSION
+        )
+        cached = cache.get(key, clubs, club_order)
+        metrics.annotate(cache_hit=cached is not None)
+        clock.lap('cache_lookup')
+
+    if cached is not None:
+        slot_assignments, notes = cached
+    else:
+        on_assignments = None
+        if on_solution is not None:
+            def on_assignments(slot_assignments, entry):
+                on_solution(summarize(slot_assignments), entry)
+
+        slot_assignments, notes, status = (solve or solve_slot_assignments)(
+            teams, allowed_matchups, matches_per_team, concurrency, game_time, break_time, spread_games,
+            force_max_concurrency, allow_more_matches, home_club, long_break_time, long_break_frequency, strategy,
+            max_wait_time, solver_profile, on_assignments=on_assignments, max_consecutive_games=max_consecutive_games,
+            max_rest_games=max_rest_games
+        )
+        clock.lap('assign_slots')
+        # Rejections name clubs, so they would be wrong for a relabeled tournament; they are cheap to repeat
+        if cache is not None and status not in ('UNKNOWN', 'REJECTED'):
+            cache.put(key, clubs, club_order, slot_assignments, notes)
+            clock.lap('cache_store')
+
+    if slot_assignments is None:
+        return [], notes, {}, {}, {}, teams
+
+    result = summarize(slot_assignments)
+    clock.lap('summarize')
+    result[1][:0] = notes
+    if strategy in ('heuristic', 'lns'):
+        for team, stats in result[4].items():
+            if stats['max_time_between'] is not None and stats['max_time_between'] > max_wait_time:
+                result[1].append(f"Team {team[1]} (Club {team[0]}) waits up to {stats['max_time_between']:.0f} "
+                                 f"minutes between matches (limit {max_wait_time}).")
+            if max_consecutive_games and stats['max_consecutive_matches'] > max_consecutive_games:
+                result[1].append(f"Team {team[1]} (Club {team[0]}) plays {stats['max_consecutive_matches']} matches "
+                                 f"in a row (limit {max_consecutive_games}).")
+            if max_rest_games is not None and stats['max_rest_games'] > max_rest_games:
+                result[1].append(f"Team {team[1]} (Club {team[0]}) rests {stats['max_rest_games']} slots in a row "
+                                 f"between matches (limit {max_rest_games}).")
+    return result
+
+def solve_around_fixed(teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+                       allow_more_matches, home_club, offsets, slot_duration, max_wait_time, fixed, hint, num_slots,
+                       solver_profile=None, stats=None, max_consecutive_games=None, max_rest_games=None):
+    """Keep the `fixed` games in their slots and place the games teams still need around them.
+
+    Teams short of their match count, and teams playing a game of `hint` that
+    is not fixed, get new games, and only matchups between them have
+    variables; the fixed games are constants (see `app.lns.solve_neighbourhood`).
+    Waits and the consecutive-game and rest limits are hard constraints. The
+    search stops within the profile's relative gap, or FIXED_RELATIVE_GAP.
+    Returns the slot assignments over `num_slots` slots, or None, and fills
+    `stats` as `app.cpsat.record_model_stats` does.
+    """
+    from app.cpsat import back_to_back_runs
+    from app.lns import solve_neighbourhood
+
+    profile = resolve_solver_profile(solver_profile)
+    games = Counter(team for matchups in fixed.values() for matchup in matchups for team in matchup)
+    freed = [(matchup, slot) for slot, matchups in (hint or {}).items() if slot < num_slots
+             for matchup in matchups if matchup not in fixed.get(slot, [])]
+    freed_teams = {team for matchup, _ in freed for team in matchup}
+    need = {}
+    for team in teams:
+        fewest = matches_per_team - games[team]
+        most = fewest + int(allow_more_matches and team[0] != home_club)
+        if fewest > 0 or most < 0 or team in freed_teams:
+            need[team] = (max(fewest, 0), most)
+
+    offsets = offsets[:num_slots]
+    assignments = {slot: list(fixed.get(slot, [])) for slot in range(num_slots)}
+    for matchup, slot in freed:
+        assignments[slot].append(matchup)
+    runs = back_to_back_runs(offsets, slot_duration, max_consecutive_games + 1) if max_consecutive_games else []
+    placed = solve_neighbourhood({
+        'assignments': assignments,
+        'freed': freed,
+        'slots': [slot for slot in range(num_slots) if len(fixed.get(slot, [])) < effective_concurrency],
+        'allowed_matchups': allowed_matchups,
+        'effective_concurrency': effective_concurrency,
+        'force_max_concurrency': force_max_concurrency,
+        'offsets': offsets,
+        'max_wait_time': max_wait_time,
+        'runs': runs,
+        'max_consecutive_games': max_consecutive_games if runs else None,
+        'max_rest_games': max_rest_games,
+        'need': need,
+        'soft_waits': False,
+        'num_slots': num_slots,
+        'time_limit': profile['time_limit'],
+        'relative_gap': profile['relative_gap'] if profile['relative_gap'] is not None else FIXED_RELATIVE_GAP,
+        'num_workers': profile['num_workers'] or 0,
+        'seed': profile['random_seed'] or 0
+    }, stats)
+    if placed is None:
+        return None
+    slot_assignments = {slot: list(fixed.get(slot, [])) for slot in range(num_slots)}
+    for slot, matchups in placed.items():
+        slot_assignments[slot] += matchups
+    return slot_assignments
+
+def solve_slot_assignments(teams, allowed_matchups, matches_per_team, concurrency, game_time, break_time, spread_games,
+                           force_max_concurrency, allow_more_matches, home_club, long_break_time, long_break_frequency,
+                           strategy, max_wait_time, solver_profile=None, on_assignments=None, hint=None, fixed=None,
+                           num_slots=None, stats=None, max_consecutive_games=None, max_rest_games=None):
+    """Assign matchups to slot indices with the heuristic and/or CP-SAT.
+
+    Returns `(slot_assignments, notes, status)`: a dict of slot index to
+    matchups (None when nothing feasible was found), warnings about how the
+    schedule was obtained, and 'HEURISTIC', 'LNS', 'REJECTED' (a feasibility
+    check in app.precheck ruled the tournament out) or the CP-SAT status name.
+    `on_assignments` is called with the assignments of every improving solution.
+    `hint` (slot assignments) seeds the search and `num_slots` fixes the
+    horizon. Without it the model is solved with the fewest slots possible
+    (`min_slots`) first and offered more, up to `horizon_slots`, only while that
+    is infeasible. With `fixed` (slot assignments) those games stay where they
+    are and only the games still missing are placed, in a small model of their
+    own (see `solve_around_fixed`) over `num_slots` or `horizon_slots` slots. A
+    `stats` dict is filled with the final model's size and presolve time, the
+    build and solve times of all attempts and the `horizons` tried with their
+    statuses (see `app.cpsat.record_model_stats`). `max_consecutive_games` and
+    `max_rest_games` limit a team's games in a row and the slots it sits out
+    between games; None leaves them open.
+    """
     total_teams = len(teams)
     max_possible_concurrency = total_teams // 2
     effective_concurrency = min(concurrency, max_possible_concurrency)
     total_required_matches = total_teams * matches_per_team / 2
+    slot_duration = game_time + (break_time if spread_games else 0)
 
-    model = cp_model.CpModel()
-    solver = cp_model.CpSolver()
-
-    num_slots = math.ceil(total_required_matches / effective_concurrency) + 4
-    matchup_slot = {m: model.NewIntVar(-1, num_slots - 1, f"matchup_{m}") for m in range(len(allowed_matchups))}
-    matchup_used = {m: model.NewBoolVar(f"used_{m}") for m in range(len(allowed_matchups))}
-
-    for m in matchup_used:
-        model.Add(matchup_slot[m] >= 0).OnlyEnforceIf(matchup_used[m])
-        model.Add(matchup_slot[m] == -1).OnlyEnforceIf(matchup_used[m].Not())
-
-    team_matches = {team: [] for team in teams}
-    for m, (t1, t2) in enumerate(allowed_matchups):
-        team_matches[t1].append(m)
-        team_matches[t2].append(m)
-
-    home_teams = [team for team in teams if team[0] == home_club]
-    away_teams = [team for team in teams if team[0] != home_club]
-    has_extra = {}
-
-    if allow_more_matches:
-        if home_club:
-            for team in home_teams:
-                match_sum = sum(matchup_used[m] for m in team_matches[team])
-                model.Add(match_sum == matches_per_team)
-            for team in away_teams:
-                match_sum = sum(matchup_used[m] for m in team_matches[team])
-                has_extra[team] = model.NewBoolVar(f"has_extra_{team}")
-                model.Add(match_sum >= matches_per_team)
-                model.Add(match_sum <= matches_per_team + 1)
+    # Rule out impossible match counts before any search
+    clock = metrics.stopwatch()
+    notes = matchup_problems(teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+                             allow_more_matches, home_club)
+    clock.lap('precheck')
+    if notes:
+        return None, notes, 'REJECTED'
+
+    if fixed is not None:
+        attempt_stats = {}
+        num_slots = num_slots or horizon_slots(total_required_matches, effective_concurrency)
+        slot_assignments = solve_around_fixed(
+            teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+            allow_more_matches, home_club, slot_offsets(num_slots, slot_duration, long_break_time, long_break_frequency),
+            slot_duration, max_wait_time, fixed, hint, num_slots, solver_profile, attempt_stats,
+            max_consecutive_games, max_rest_games
+        )
+        clock.lap('solve')
+        if stats is not None:
+            stats.update(attempt_stats, horizons=[(num_slots, attempt_stats['status'])])
+        if slot_assignments is None:
+            notes.append(f"No feasible schedule found. Solver status: {attempt_stats['status']}")
+        elif attempt_stats['status'] == 'FEASIBLE':
+            notes.insert(0, f"Search stopped after {attempt_stats['solve_time']:.1f}s; showing the best schedule "
+                            f"found, which is not proven optimal.")
+        return slot_assignments, notes, attempt_stats['status']
+
+    heuristic_assignments = None
+    if strategy != 'cp':
+        heuristic_assignments = construct_schedule(
+            teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+            allow_more_matches, home_club,
+            slot_offsets(2 * len(allowed_matchups) + 1, slot_duration, long_break_time, long_break_frequency),
+            max_wait_time, max_consecutive_games, max_rest_games
+        )
+        clock.lap('heuristic')
+        if heuristic_assignments is None:
+            notes.append("The fast scheduler could not build a schedule; used full optimization instead.")
+        elif strategy == 'heuristic':
+            return heuristic_assignments, notes, 'HEURISTIC'
+        elif strategy == 'lns':
+            from app.lns import improve_schedule, schedule_objective
+            profile = resolve_solver_profile(solver_profile)
+            if num_slots is None:
+                num_slots = max(horizon_slots(total_required_matches, effective_concurrency), len(heuristic_assignments))
+            started = time.time()
+
+            def report(slot_assignments, entry):
+                if entry['improved'] and on_assignments is not None:
+                    on_assignments(slot_assignments, {'objective': entry['objective'], 'wall_time': entry['elapsed'],
+                                                      'timestamp': time.time()})
+
+            initial = schedule_objective(heuristic_assignments)
+            slot_assignments, history = improve_schedule(
+                heuristic_assignments, teams, allowed_matchups, effective_concurrency, force_max_concurrency,
+                slot_offsets(num_slots + 1, slot_duration, long_break_time, long_break_frequency), max_wait_time,
+                num_slots, time_limit=profile['time_limit'] or 60, window_size=profile['lns_window_size'],
+                club_count=profile['lns_club_count'], sub_time_limit=profile['lns_sub_time_limit'],
+                max_stale=profile['lns_max_stale'], workers=profile['num_workers'] or min(4, os.cpu_count() or 1),
+                seed=profile['random_seed'] or 0, on_iteration=report, slot_duration=slot_duration,
+                max_consecutive_games=max_consecutive_games, max_rest_games=max_rest_games
+            )
+            clock.lap('lns')
+            notes.append(f"Large-neighbourhood search ran {len(history)} iterations in {time.time() - started:.1f}s, "
+                         f"objective {initial} to {schedule_objective(slot_assignments)}.")
+            return slot_assignments, notes, 'LNS'
+
+    # Teams of a club are interchangeable, so only the relabeling with their slot
+    # patterns in decreasing order is searched.
+    profile = resolve_solver_profile(solver_profile)
+    symmetry_breaking = profile['symmetry_breaking']
+    symmetry_groups = []
+    if symmetry_breaking:
+        symmetry_groups = interchangeable_teams(teams, allowed_matchups, home_club)
+
+    # Start the search from the heuristic schedule, or the caller's hint, when there is one
+    position = {matchup: m for m, matchup in enumerate(allowed_matchups)}
+    if heuristic_assignments is not None:
+        hint = heuristic_assignments
+    if hint is not None and symmetry_groups:
+        hint = order_interchangeable(hint, symmetry_groups, allowed_matchups, symmetry_breaking)
+
+    # Without a given horizon, try the fewest slots any schedule needs first and
+    # only offer more when that is proven infeasible (see `horizon_steps`). The
+    # first slot is always used, so with long breaks a schedule cannot simply
+    # start later in the day; one more block of slots is offered last instead.
+    extra = 0
+    if num_slots is None:
+        upper = horizon_slots(total_required_matches, effective_concurrency)
+        lower = min(upper, min_slots(matches_per_team, total_teams, effective_concurrency, slot_duration,
+                                     long_break_time, long_break_frequency, max_wait_time, max_consecutive_games))
+        if long_break_time and long_break_frequency:
+            extra = long_break_frequency
+    else:
+        lower = upper = num_slots
+
+    # Waits are hard constraints in the model, so check they can be kept at all
+    problems = horizon_problems(matches_per_team, total_teams, effective_concurrency, slot_duration, long_break_time,
+                                long_break_frequency, max_wait_time, upper)
+    if not problems:
+        problems = streak_problems(matches_per_team, total_teams, effective_concurrency, force_max_concurrency,
+                                   slot_duration, long_break_time, long_break_frequency, max_wait_time,
+                                   max_consecutive_games, upper)
+    if problems:
+        return None, notes + problems, 'REJECTED'
+
+    # OR-Tools is only loaded once a model is actually built (see app.cpsat)
+    from ortools.sat.python import cp_model
+    from app.cpsat import (SolutionRecorder, add_consecutive_limit, add_rest_limit, back_to_back_runs,
+                           record_model_stats, watch_presolve)
+
+    def solve_horizon(num_slots, fewest_slots, time_limit, attempt_stats):
+        build_started = time.perf_counter()
+        model = cp_model.CpModel()
+        solver = cp_model.CpSolver()
+        slots = range(num_slots)
+
+        # x[m, slot] is true when matchup m is played in that slot; each matchup
+        # takes at most one slot and is "used" exactly when it takes one.
+        x = {(m, slot): model.NewBoolVar(f"x_{m}_{slot}") for m in range(len(allowed_matchups)) for slot in slots}
+        matchup_used = {m: model.NewBoolVar(f"used_{m}") for m in range(len(allowed_matchups))}
+        for m in matchup_used:
+            model.AddExactlyOne([x[m, slot] for slot in slots] + [matchup_used[m].Not()])
+
+        # Start the search from the hint's games within the horizon, when there is one
+        if hint is not None:
+            hinted = {(position[matchup], slot) for slot, matchups in hint.items() if slot < num_slots
+                      for matchup in matchups}
+            for (m, slot), var in x.items():
+                model.AddHint(var, (m, slot) in hinted)
+            hinted_matchups = {m for m, _ in hinted}
+            for m, var in matchup_used.items():
+                model.AddHint(var, m in hinted_matchups)
+
+        team_matches = {team: [] for team in teams}
+        for m, (t1, t2) in enumerate(allowed_matchups):
+            team_matches[t1].append(m)
+            team_matches[t2].append(m)
+
+        home_teams = [team for team in teams if team[0] == home_club]
+        away_teams = [team for team in teams if team[0] != home_club]
+        has_extra = {}
+
+        if allow_more_matches:
+            if home_club:
+                for team in home_teams:
+                    match_sum = sum(matchup_used[m] for m in team_matches[team])
+                    model.Add(match_sum == matches_per_team)
+                for team in away_teams:
+                    match_sum = sum(matchup_used[m] for m in team_matches[team])
+                    has_extra[team] = model.NewBoolVar(f"has_extra_{team}")
+                    model.Add(match_sum >= matches_per_team)
+                    model.Add(match_sum <= matches_per_team + 1)
+            else:
+                for team in teams:
+                    match_sum = sum(matchup_used[m] for m in team_matches[team])
+                    has_extra[team] = model.NewBoolVar(f"has_extra_{team}")
+                    model.Add(match_sum >= matches_per_team)
+                    model.Add(match_sum <= matches_per_team + 1)
         else:
             for team in teams:
                 match_sum = sum(matchup_used[m] for m in team_matches[team])
-                has_extra[team] = model.NewBoolVar(f"has_extra_{team}")
-                model.Add(match_sum >= matches_per_team)
-                model.Add(match_sum <= matches_per_team + 1)
-    else:
-        for team in teams:
-            match_sum = sum(matchup_used[m] for m in team_matches[team])
-            model.Add(match_sum == matches_per_team)
+                model.Add(match_sum == matches_per_team)
 
-    slot_counts = []
-    slot_used = []
-    for slot in range(num_slots):
-        slot_matches = []
-        for m, (t1, t2) in enumerate(allowed_matchups):
-            is_in_slot = model.NewBoolVar(f"slot_{slot}_{m}")
-            model.Add(matchup_slot[m] == slot).OnlyEnforceIf(is_in_slot)
-            model.Add(matchup_slot[m] != slot).OnlyEnforceIf(is_in_slot.Not())
-            slot_matches.append(is_in_slot)
-
-        count = model.NewIntVar(0, effective_concurrency, f"slot_count_{slot}")
-        used = model.NewBoolVar(f"slot_used_{slot}")
-        model.Add(count == sum(slot_matches))
-        model.Add(count > 0).OnlyEnforceIf(used)
-        model.Add(count == 0).OnlyEnforceIf(used.Not())
-        slot_counts.append(count)
-        slot_used.append(used)
+        clock.lap('model_matchups')
+
+        slot_counts = []
+        slot_used = []
+        occupied = {}
+        for slot in slots:
+            count = cp_model.LinearExpr.Sum([x[m, slot] for m in range(len(allowed_matchups))])
+            used = model.NewBoolVar(f"slot_used_{slot}")
+            model.Add(count <= effective_concurrency * used)
+            model.Add(count >= used)
+            slot_counts.append(count)
+            slot_used.append(used)
+
+            # A team's occupancy of a slot is a 0/1 variable, which also keeps it
+            # to at most one match per slot.
+            for team in teams:
+                occupied[team, slot] = model.NewBoolVar(f"occupied_{team}_{slot}")
+                model.Add(cp_model.LinearExpr.Sum([x[m, slot] for m in team_matches[team]]) == occupied[team, slot])
+
+        # The first games start at the start time, which long breaks are counted from
+        model.Add(slot_used[0] == 1)
+
+        clock.lap('model_slots')
+
+        # Symmetry breaking between consecutive interchangeable teams. With
+        # 'opponents' the earlier team's row of matchups used, over their common
+        # opponents, is lexicographically no smaller. With 'slots' the earlier team
+        # plays its first game no later, i.e. its "has started" row is no smaller.
+        matchup_index = {matchup: m for m, matchup in enumerate(allowed_matchups)}
+        for group in symmetry_groups:
+            if symmetry_breaking == 'slots':
+                started = {}
+                for team in group:
+                    for slot in slots:
+                        started[team, slot] = model.NewBoolVar(f"started_{team}_{slot}")
+                        model.AddMaxEquality(started[team, slot],
+                                             [occupied[team, slot]] + ([started[team, slot - 1]] if slot else []))
+                for first, second in zip(group, group[1:]):
+                    for slot in slots:
+                        model.Add(started[first, slot] >= started[second, slot])
+                continue
+            for first, second in zip(group, group[1:]):
+                rows = []
+                for opponent in team_opponents_order(first, allowed_matchups):
+                    pair = [matchup_index.get((team, opponent), matchup_index.get((opponent, team)))
+                            for team in (first, second)]
+                    rows.append([matchup_used[m] for m in pair])
+                same = None
+                for i, (used_first, used_second) in enumerate(rows):
+                    constraint = model.Add(used_first >= used_second)
+                    if same is not None:
+                        constraint.OnlyEnforceIf(same)
+                    if i == len(rows) - 1:
+                        break
+                    # `agreed` is forced true while both rows agree up to this opponent
+                    agreed = model.NewBoolVar(f"same_{first}_{second}_{i}")
+                    before = 1 if same is None else same
+                    model.Add(agreed >= before - used_first - used_second)
+                    model.Add(agreed >= before + used_first + used_second - 2)
+                    same = agreed
+
+        clock.lap('model_symmetry')
 
+        if force_max_concurrency:
+            for slot in slots:
+                model.Add(slot_counts[slot] == effective_concurrency).OnlyEnforceIf(slot_used[slot])
+            for slot in range(num_slots - 1):
+                model.Add(slot_used[slot + 1] <= slot_used[slot])
+
+        total_matches = sum(matchup_used[m] for m in range(len(allowed_matchups)))
+        if allow_more_matches:
+            model.Add(total_matches >= int(total_required_matches))
+        else:
+            model.Add(total_matches == int(total_required_matches))
+
+        slot_penalty = cp_model.LinearExpr.WeightedSum(slot_counts, list(slots))
+        max_slot = model.NewIntVar(min(fewest_slots, num_slots) - 1, num_slots - 1, "max_slot")
+        for slot in slots:
+            model.Add(max_slot >= slot).OnlyEnforceIf(slot_used[slot])
+        model.Minimize(slot_penalty + 1000 * max_slot)
+
+        # Max wait time: between two consecutive games of a team, measured start to
+        # start, at most max_wait_time minutes may pass. For every slot we know the
+        # furthest slot still within reach; if a team has played by `slot` and plays
+        # again after that reach, it must also play somewhere in between.
+        offsets = slot_offsets(num_slots, slot_duration, long_break_time, long_break_frequency)
+        reaches = []
+        reach = 0
+        for slot in slots:
+            reach = max(reach, slot)
+            while reach + 1 < num_slots and offsets[reach + 1] - offsets[slot] <= max_wait_time:
+                reach += 1
+            reaches.append(reach)
         for team in teams:
-            team_slot_matches = [slot_matches[m] for m in team_matches[team]]
-            model.Add(sum(team_slot_matches) <= 1)
-
-    if force_max_concurrency:
-        for slot in range(num_slots):
-            model.Add(slot_counts[slot] == effective_concurrency).OnlyEnforceIf(slot_used[slot])
-        for slot in range(num_slots - 1):
-            model.Add(slot_used[slot + 1] <= slot_used[slot])
-
-    total_matches = sum(matchup_used[m] for m in range(len(allowed_matchups)))
-    if allow_more_matches:
-        model.Add(total_matches >= int(total_required_matches))
-    else:
-        model.Add(total_matches == int(total_required_matches))
-
-    slot_penalty = sum(slot * slot_counts[slot] for slot in range(num_slots))
-    max_slot = model.NewIntVar(0, num_slots - 1, "max_slot")
-    for m in matchup_slot:
-        model.Add(max_slot >= matchup_slot[m])
-    model.Minimize(slot_penalty + 1000 * max_slot)
-
-    # Add max wait time constraints
-    slot_duration = game_time + (break_time if spread_games else 0)
-    for team in teams:
-        team_matchups = team_matches[team]
-        if len(team_matchups) >= 2:
-            # For each pair of consecutive matches for this team
-            for i, j in itertools.combinations(team_matchups, 2):
-                # Create an ordering variable
-                i_before_j = model.NewBoolVar(f"match_{i}_before_{j}")
-                
-                # Create a variable to check if both matchups are used
-                both_used = model.NewBoolVar(f"both_used_{i}_{j}")
-                model.AddBoolAnd([matchup_used[i], matchup_used[j]]).OnlyEnforceIf(both_used)
-                model.AddBoolOr([matchup_used[i].Not(), matchup_used[j].Not()]).OnlyEnforceIf(both_used.Not())
-                
-                # Enforce ordering only if both matchups are used
-                model.Add(matchup_slot[i] < matchup_slot[j]).OnlyEnforceIf([both_used, i_before_j])
-                model.Add(matchup_slot[j] < matchup_slot[i]).OnlyEnforceIf([both_used, i_before_j.Not()])
-                
-                # If i is before j and both are used, constrain wait time
-                wait_slots = model.NewIntVar(0, num_slots, f"wait_slots_{i}_{j}")
-                model.Add(wait_slots == matchup_slot[j] - matchup_slot[i]).OnlyEnforceIf([both_used, i_before_j])
-                
-                # Convert slots to minutes
-                wait_minutes = model.NewIntVar(0, num_slots * slot_duration, f"wait_minutes_{i}_{j}")
-                model.Add(wait_minutes == wait_slots * slot_duration).OnlyEnforceIf([both_used, i_before_j])
-                
-                # Consider long breaks
-                if long_break_frequency > 0:
-                    # Pre-calculate max possible breaks as a Python integer
-                    max_breaks = num_slots // long_break_frequency
-                    
-                    # Calculate number of long breaks between i and j
-                    breaks_between = model.NewIntVar(0, max_breaks, f"breaks_between_{i}_{j}")
-                    
-                    # Use AddDivisionEquality for the division operation
-                    temp_div_result = model.NewIntVar(0, num_slots, f"temp_div_{i}_{j}")
-                    model.AddDivisionEquality(temp_div_result, wait_slots, long_break_frequency)
-                    model.Add(breaks_between <= temp_div_result).OnlyEnforceIf([both_used, i_before_j])
-                    
-                    # Adjust wait time calculation with long breaks
-                    adjusted_wait = model.NewIntVar(0, num_slots * slot_duration + num_slots * long_break_time, 
-                                                    f"adjusted_wait_{i}_{j}")
-                    model.Add(adjusted_wait == wait_minutes + breaks_between * (long_break_time - break_time)).OnlyEnforceIf([both_used, i_before_j])
-                    
-                    # Apply max wait constraint with adjusted time
-                    model.Add(adjusted_wait <= max_wait_time).OnlyEnforceIf([both_used, i_before_j])
-                else:
-                    # Apply max wait constraint without extra long breaks
-                    model.Add(wait_minutes <= max_wait_time).OnlyEnforceIf([both_used, i_before_j])
-                
-                # Same constraints for j before i
-                wait_slots_rev = model.NewIntVar(0, num_slots, f"wait_slots_rev_{i}_{j}")
-                model.Add(wait_slots_rev == matchup_slot[i] - matchup_slot[j]).OnlyEnforceIf([both_used, i_before_j.Not()])
-                
-                wait_minutes_rev = model.NewIntVar(0, num_slots * slot_duration, f"wait_minutes_rev_{i}_{j}")
-                model.Add(wait_minutes_rev == wait_slots_rev * slot_duration).OnlyEnforceIf([both_used, i_before_j.Not()])
-                
-                if long_break_frequency > 0:
-                    # Use the same pre-calculated max breaks value
-                    breaks_between_rev = model.NewIntVar(0, max_breaks, 
-                                                         f"breaks_between_rev_{i}_{j}")
-                    
-                    # Use AddDivisionEquality here too
-                    temp_div_result_rev = model.NewIntVar(0, num_slots, f"temp_div_rev_{i}_{j}")
-                    model.AddDivisionEquality(temp_div_result_rev, wait_slots_rev, long_break_frequency)
-                    model.Add(breaks_between_rev <= temp_div_result_rev).OnlyEnforceIf([both_used, i_before_j.Not()])
-                    
-                    adjusted_wait_rev = model.NewIntVar(0, num_slots * slot_duration + num_slots * long_break_time, 
-                                                        f"adjusted_wait_rev_{i}_{j}")
-                    model.Add(adjusted_wait_rev == wait_minutes_rev + breaks_between_rev * (long_break_time - break_time)).OnlyEnforceIf([both_used, i_before_j.Not()])
-                    
-                    model.Add(adjusted_wait_rev <= max_wait_time).OnlyEnforceIf([both_used, i_before_j.Not()])
-                else:
-                    # Apply max wait constraint without extra long breaks (reverse)
-                    model.Add(wait_minutes_rev <= max_wait_time).OnlyEnforceIf([both_used, i_before_j.Not()])
-
-    status = solver.Solve(model)
-    if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-        return [], [f"No feasible schedule found. Solver status: {status}"], {}, {}, {}, teams
-
+            if len(team_matches[team]) < 2:
+                continue
+            played_by = [model.NewBoolVar(f"played_by_{team}_{slot}") for slot in slots]
+            plays_from = [model.NewBoolVar(f"plays_from_{team}_{slot}") for slot in slots]
+            for slot in slots:
+                model.Add(played_by[slot] >= occupied[team, slot])
+                model.Add(plays_from[slot] >= occupied[team, slot])
+                if slot > 0:
+                    model.Add(played_by[slot] >= played_by[slot - 1])
+                    model.Add(plays_from[slot - 1] >= plays_from[slot])
+
+            for slot, reach in enumerate(reaches):
+                if reach + 1 >= num_slots:
+                    break
+                window = [occupied[team, s] for s in range(slot + 1, reach + 1)]
+                model.Add(played_by[slot] + plays_from[reach + 1] - cp_model.LinearExpr.Sum(window) <= 1)
+
+            # Max rest games: the same window over the max_rest_games + 1 slots after
+            # `slot`, skipped where the wait limit already reaches no further.
+            if max_rest_games is not None:
+                add_rest_limit(model, [occupied[team, slot] for slot in slots], played_by, plays_from,
+                               max_rest_games, reaches)
+
+        # Max consecutive games: of any max_consecutive_games + 1 back-to-back slots,
+        # with no long break between them, a team plays at most max_consecutive_games.
+        if max_consecutive_games:
+            runs = back_to_back_runs(offsets, slot_duration, max_consecutive_games + 1)
+            for team in teams:
+                add_consecutive_limit(model, [occupied[team, slot] for slot in slots], runs, max_consecutive_games)
+            for slot in runs:
+                model.Add(cp_model.LinearExpr.Sum(slot_counts[slot:slot + max_consecutive_games + 1])
+                          <= total_teams * max_consecutive_games // 2)
+
+        clock.lap('model_wait')
+
+        def assignments(value):
+            slot_assignments = {slot: [] for slot in slots}
+            for m, matchup in enumerate(allowed_matchups):
+                for slot in slots:
+                    if value(x[m, slot]):
+                        slot_assignments[slot].append(matchup)
+                        break
+            return slot_assignments
+
+        configure_solver(solver, dict(solver_profile or {}, time_limit=time_limit))
+        attempt_stats['build_time'] = time.perf_counter() - build_started
+        presolve = watch_presolve(solver) if stats is not None else {}
+        recorder = SolutionRecorder(assignments, on_assignments)
+        status = solver.Solve(model, recorder)
+        clock.lap('solve')
+        metrics.record_solve(model, solver, status)
+        record_model_stats(attempt_stats, model, solver, status, presolve)
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            return status, None
+        return status, assignments(solver.BooleanValue)
+
+    # A proof of infeasibility at a small horizon can take long, so with a time
+    # limit each smaller horizon gets half the time left and running out moves
+    # straight on to `upper`. The extra block only gets what `upper` left over.
+    deadline = time.perf_counter() + profile['time_limit'] if profile['time_limit'] is not None else None
+    horizons = []
+    solve_time = build_time = 0
+    steps = horizon_steps(lower, upper, extra)
+    largest = upper + extra
+    horizon = next(steps)
+    fewest_slots = lower if num_slots is None else 1
+    while True:
+        time_limit = None
+        if deadline is not None:
+            time_limit = max(0.0, deadline - time.perf_counter())
+            if horizon < upper:
+                time_limit /= 2
+        attempt_stats = {}
+        status, slot_assignments = solve_horizon(horizon, fewest_slots, time_limit, attempt_stats)
+        horizons.append((horizon, attempt_stats['status']))
+        solve_time += attempt_stats['solve_time']
+        build_time += attempt_stats['build_time']
+        if horizon == largest or slot_assignments is not None:
+            break
+        if status == cp_model.INFEASIBLE:
+            # Every schedule needs more slots than this horizon, which bounds the next model's objective
+            fewest_slots = horizon + 1
+            horizon = next(steps)
+        elif horizon < upper:
+            horizon = upper
+        else:
+            break
+    if stats is not None:
+        stats.update(attempt_stats, solve_time=solve_time, build_time=build_time, horizons=horizons)
+    status_name = attempt_stats['status']
+    if slot_assignments is None:
+        notes.append(f"No feasible schedule found. Solver status: {status_name}")
+        if extra and status == cp_model.INFEASIBLE:
+            notes.append(f"The first matches start at the start time, with a long break after every "
+                         f"{long_break_frequency} slots from there; another long break frequency or looser wait "
+                         f"and consecutive-game limits may fit.")
+        return None, notes, status_name
+
+    if status == cp_model.FEASIBLE:
+        notes.insert(0, f"Search stopped after {solve_time:.1f}s; showing the best schedule found, "
+                        f"which is not proven optimal.")
+    return slot_assignments, notes, status_name
+
+def summarize_schedule(slot_assignments, teams, matches_per_team, concurrency, game_time, break_time, spread_games,
+                       start_time, force_max_concurrency, allow_more_matches, home_club, restricted_clubs,
+                       long_break_time, long_break_frequency):
+    """Turn matchups assigned to slot indices into the schedule, team statistics and warnings."""
     schedule = []
     current_time = start_time
-    slot_assignments = {s: [] for s in range(num_slots)}
-    team_match_times = {team: [] for team in teams}
-
-    for m, (t1, t2) in enumerate(allowed_matchups):
-        slot = solver.Value(matchup_slot[m])
-        if slot >= 0:
-            slot_assignments[slot].append((t1, t2))
+    num_slots = len(slot_assignments)
+    slot_duration = game_time + (break_time if spread_games else 0)
 
+    # Slots start at their `slot_offsets` time, so an empty slot between games
+    # leaves the same rest and wait in the schedule as in the model
     for slot in range(num_slots):
         if slot_assignments[slot]:
-            match_time = current_time
-            schedule.append((match_time, slot_assignments[slot]))
-            for (c1, t1), (c2, t2) in slot_assignments[slot]:
-                team_match_times[(c1, t1)].append(match_time)
-                team_match_times[(c2, t2)].append(match_time)
-            delta = game_time + (break_time if spread_games else 0)
-            current_time += timedelta(minutes=delta)
-            if long_break_frequency > 0 and (slot + 1) % long_break_frequency == 0 and slot < num_slots - 1:
-                current_time += timedelta(minutes=long_break_time)
-
-    team_games = {team: 0 for team in teams}
+            schedule.append((current_time, slot_assignments[slot]))
+        current_time += timedelta(minutes=slot_duration)
+        if long_break_frequency > 0 and (slot + 1) % long_break_frequency == 0:
+            current_time += timedelta(minutes=long_break_time)
+
     team_opponents = {team: set() for team in teams}
     for slot in slot_assignments.values():
         for (c1, t1), (c2, t2) in slot:
-            team_games[(c1, t1)] += 1
-            team_games[(c2, t2)] += 1
             team_opponents[(c1, t1)].add(t2)
             team_opponents[(c2, t2)].add(t1)
     team_opponents = {team: list(opps) for team, opps in team_opponents.items()}
 
-    team_timing_stats = {
-        team: {
-            'first_match': None,
-            'last_match': None,
-            'min_time_between': None,
-            'max_time_between': None,
-            'median_time_between': None,
-            'max_consecutive_matches': 0
-        } for team in teams
-    }
-
-    for team, times in team_match_times.items():
-        if times:
-            times_sorted = sorted(times)
-            time_diffs = [(times_sorted[i+1] - times_sorted[i]).total_seconds() / 60
-                         for i in range(len(times_sorted)-1)]
-
-            slot_times = sorted(set(times_sorted))
-            consecutive_count = 1
-            max_consecutive = 1
-            slot_duration = game_time + (break_time if spread_games else 0)
-            for i in range(1, len(slot_times)):
-                if (slot_times[i] - slot_times[i-1]).total_seconds() / 60 == slot_duration:
-                    consecutive_count += 1
-                    max_consecutive = max(max_consecutive, consecutive_count)
-                else:
-                    consecutive_count = 1
-
-            team_timing_stats[team] = {
-                'first_match': times_sorted[0],
-                'last_match': times_sorted[-1],
-                'min_time_between': min(time_diffs) if time_diffs else None,
-                'max_time_between': max(time_diffs) if time_diffs else None,
-                'median_time_between': statistics.median(time_diffs) if time_diffs else None,
-                'max_consecutive_matches': max_consecutive
-            }
+    analysis = analyze_schedule(schedule, teams, slot_duration, long_break_time=long_break_time,
+                                long_break_frequency=long_break_frequency)
+    team_games, team_timing_stats = team_statistics(analysis, schedule, teams)
 
+    total_teams = len(teams)
+    effective_concurrency = min(concurrency, total_teams // 2)
     warnings = []
     used_slots = len([s for s in slot_assignments if slot_assignments[s]])
     if long_break_frequency > 0 and used_slots > 1 and used_slots % long_break_frequency == 1:
@@ -329,4 +817,4 @@ def generate_and_schedule_matchups(clubs, matches_per_team, concurrency, game_ti
     if restricted_clubs:
         warnings.append(f"Restricted matches between: {', '.join([f'{c1} vs {c2}' for c1, c2 in restricted_clubs])}")
 
-    return schedule, warnings, team_games, team_opponents, team_timing_stats, teams
\ No newline at end of file
+    return schedule, warnings, team_games, team_opponents, team_timing_stats, teams
@@ -0,0 +1,450 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from ortools.sat.python import cp_model
+
+from app.analytics import analyze_schedule, team_statistics
+from app.cpsat import add_consecutive_limit, add_rest_limit, back_to_back_runs
+from app.precheck import matchup_problems, team_match_bounds
+from app.utils import format_time, parse_time, resolve_solver_profile, slot_offsets, tournament_matchups
+
+DAY_MINUTES = 24 * 60
+
+# Rounds of re-solving venues with the other venues' games fixed before remaining clashes are reported
+RECONCILE_ROUNDS = 4
+
+def parse_venues(data, game_time, slot_duration, long_break_time, long_break_frequency):
+    """Build venue dicts from a JSON list of venues.
+
+    Each venue is one rink on one day: `name`, `day` (0 for the first day),
+    `start_time` (HH:MM), either `slots` or `end_time` (the last game ends by
+    then), `capacity` (concurrent games, default 1), optional
+    `long_break_time` / `long_break_frequency` overriding the tournament's,
+    and optional `clubs` tied to it. A club listed at any venue only plays at
+    the venues that list it. Each venue gets `times`, its slot starts in
+    minutes from midnight of the first day. Raises ValueError on bad input.
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("'venues' must be a non-empty list.")
+    venues = []
+    for entry in data:
+        name = entry.get('name')
+        if not name:
+            raise ValueError("Every venue needs a name.")
+        day = int(entry.get('day', 0))
+        capacity = int(entry.get('capacity', 1))
+        if day < 0 or capacity < 1:
+            raise ValueError(f"Venue {name}: day must be 0 or more and capacity at least 1.")
+        venue_long_break_time = int(entry.get('long_break_time', long_break_time))
+        venue_long_break_frequency = int(entry.get('long_break_frequency', long_break_frequency))
+        start = parse_time(entry['start_time'])
+        opens = day * DAY_MINUTES + start.hour * 60 + start.minute
+        if 'slots' in entry:
+            num_slots = int(entry['slots'])
+        elif 'end_time' in entry:
+            end = parse_time(entry['end_time'])
+            closes = day * DAY_MINUTES + end.hour * 60 + end.minute
+            num_slots = 0
+            while (opens + slot_offsets(num_slots + 1, slot_duration, venue_long_break_time,
+                                        venue_long_break_frequency)[-1] + game_time <= closes):
+                num_slots += 1
+        else:
+            raise ValueError(f"Venue {name}: give either 'slots' or 'end_time'.")
+        if num_slots < 1:
+            raise ValueError(f"Venue {name} has no room for a game.")
+        offsets = slot_offsets(num_slots, slot_duration, venue_long_break_time, venue_long_break_frequency)
+        venues.append({
+            'name': name,
+            'day': day,
+            'capacity': capacity,
+            'num_slots': num_slots,
+            'times': [opens + offset for offset in offsets],
+            'clubs': set(entry['clubs']) if entry.get('clubs') else None
+        })
+    return venues
+
+def allowed_venues(club, venues):
+    """Return the indices of the venues a club may play at."""
+    tied = [v for v, venue in enumerate(venues) if venue['clubs'] is not None and club in venue['clubs']]
+    if tied:
+        return tied
+    return list(range(len(venues)))
+
+def home_venues(teams, venues):
+    """Give every team a home venue: tied teams their first venue, the others spread in proportion to room."""
+    room = [venue['capacity'] * venue['num_slots'] for venue in venues]
+    placed = [0] * len(venues)
+    homes = {}
+    for team in sorted(teams, key=lambda team: len(allowed_venues(team[0], venues))):
+        homes[team] = min(allowed_venues(team[0], venues), key=lambda v: (placed[v] / room[v], v))
+        placed[homes[team]] += 1
+    return homes
+
+def assign_venues(teams, allowed_matchups, venues, matches_per_team, allow_more_matches, home_club, time_limit,
+                  num_workers=None):
+    """Choose the matchups to play and the venue of each, without fixing slots.
+
+    Keeps each team's match count, each venue's games within its capacity
+    times its slots, and a team's games at a venue within the venue's slots.
+    Mostly minimizes games played away from the teams' home venues (see
+    `home_venues`), so most teams stay at one venue and the venues can be
+    scheduled apart; after that it evens out the slots each venue needs.
+    Returns a list with the matchups of each venue, or None if none was found.
+    """
+    model = cp_model.CpModel()
+    homes = home_venues(teams, venues)
+    y = {}
+    for m, (t1, t2) in enumerate(allowed_matchups):
+        for v in set(allowed_venues(t1[0], venues)) & set(allowed_venues(t2[0], venues)):
+            y[m, v] = model.NewBoolVar(f"y_{m}_{v}")
+    matchup_venues = {}
+    team_venue = {}
+    for (m, v), var in y.items():
+        matchup_venues.setdefault(m, []).append(var)
+        for team in allowed_matchups[m]:
+            team_venue.setdefault((team, v), []).append(var)
+    for m, options in matchup_venues.items():
+        model.AddAtMostOne(options)
+
+    bounds = team_match_bounds(teams, matches_per_team, allow_more_matches, home_club)
+    team_games = {team: [] for team in teams}
+    for (team, v), options in team_venue.items():
+        team_games[team] += options
+        model.Add(sum(options) <= venues[v]['num_slots'])
+    for team, (low, high) in bounds.items():
+        model.AddLinearConstraint(sum(team_games[team]), low, high)
+    total_required_matches = len(teams) * matches_per_team / 2
+    if allow_more_matches:
+        model.Add(sum(y.values()) >= int(total_required_matches))
+    else:
+        model.Add(sum(y.values()) == int(total_required_matches))
+
+    need = []
+    for v, venue in enumerate(venues):
+        load = sum(var for (_, w), var in y.items() if w == v)
+        model.Add(load <= venue['capacity'] * venue['num_slots'])
+        slots_needed = model.NewIntVar(0, venue['num_slots'], f"slots_needed_{v}")
+        model.Add(venue['capacity'] * slots_needed >= load)
+        need.append(slots_needed)
+    most_needed = model.NewIntVar(0, max(venue['num_slots'] for venue in venues), "most_needed")
+    model.AddMaxEquality(most_needed, need)
+    away = sum(((homes[t1] != v) + (homes[t2] != v)) * var for (m, v), var in y.items()
+               for t1, t2 in [allowed_matchups[m]])
+    model.Minimize((max(venue['num_slots'] for venue in venues) + 1) * away + most_needed)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    if num_workers is not None:
+        solver.parameters.num_search_workers = num_workers
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+    venue_matchups = [[] for _ in venues]
+    for (m, v), var in y.items():
+        if solver.BooleanValue(var):
+            venue_matchups[v].append(allowed_matchups[m])
+    return venue_matchups
+
+def solve_venue(task):
+    """Assign one venue's matchups to its slots.
+
+    `task` holds the venue's `matchups` (all of which are played), slot
+    `times`, `capacity`, the `slot_duration` and `max_wait_time`, and
+    `external`: each team's games at other venues, as start times. A team
+    does not play within a slot duration of an external game, and waits are
+    measured across venues on the same day. `max_consecutive_games` and
+    `max_rest_games` hold on the venue's slots, where an external game counts
+    in the slot it starts during. Returns `(assignments, status name)`, with
+    assignments a dict of slot index to matchups or None.
+    """
+    matchups = task['matchups']
+    times = task['times']
+    num_slots = len(times)
+    slot_duration = task['slot_duration']
+    max_wait_time = task['max_wait_time']
+    external = task['external']
+    if not matchups:
+        return {}, 'OPTIMAL'
+
+    model = cp_model.CpModel()
+    slots = range(num_slots)
+    x = {(m, slot): model.NewBoolVar(f"x_{m}_{slot}") for m in range(len(matchups)) for slot in slots}
+    for m in range(len(matchups)):
+        model.AddExactlyOne([x[m, slot] for slot in slots])
+
+    team_matches = {}
+    for m, matchup in enumerate(matchups):
+        for team in matchup:
+            team_matches.setdefault(team, []).append(m)
+
+    slot_used = []
+    for slot in slots:
+        used = model.NewBoolVar(f"slot_used_{slot}")
+        model.Add(sum(x[m, slot] for m in range(len(matchups))) <= task['capacity'] * used)
+        slot_used.append(used)
+    occupied = {}
+    for team, team_ms in team_matches.items():
+        for slot in slots:
+            occupied[team, slot] = model.NewBoolVar(f"occupied_{team}_{slot}")
+            model.Add(sum(x[m, slot] for m in team_ms) == occupied[team, slot])
+            if any(abs(times[slot] - other) < slot_duration for other in external.get(team, ())):
+                model.Add(occupied[team, slot] == 0)
+
+    # The wait chain of model_wait in solve_slot_assignments, over this venue's
+    # slots and the team's games elsewhere on the same day
+    day = times[0] // DAY_MINUTES
+    for team in team_matches:
+        elsewhere = [other for other in external.get(team, ()) if other // DAY_MINUTES == day]
+        if len(team_matches[team]) + len(elsewhere) < 2:
+            continue
+        points = sorted([(times[slot], occupied[team, slot]) for slot in slots] + [(other, 1) for other in elsewhere],
+                        key=lambda point: point[0])
+        played_by = [model.NewBoolVar(f"played_by_{team}_{i}") for i in range(len(points))]
+        plays_from = [model.NewBoolVar(f"plays_from_{team}_{i}") for i in range(len(points))]
+        for i, (_, occupancy) in enumerate(points):
+            model.Add(played_by[i] >= occupancy)
+            model.Add(plays_from[i] >= occupancy)
+            if i > 0:
+                model.Add(played_by[i] >= played_by[i - 1])
+                model.Add(plays_from[i - 1] >= plays_from[i])
+        reach = 0
+        for i, (start, _) in enumerate(points):
+            reach = max(reach, i)
+            while reach + 1 < len(points) and points[reach + 1][0] - start <= max_wait_time:
+                reach += 1
+            if reach + 1 >= len(points):
+                break
+            window = [occupancy for _, occupancy in points[i + 1:reach + 1]]
+            model.Add(played_by[i] + plays_from[reach + 1] - sum(window) <= 1)
+
+    # Consecutive and rest limits over the venue's slots, as in solve_slot_assignments
+    max_consecutive_games = task.get('max_consecutive_games')
+    max_rest_games = task.get('max_rest_games')
+    runs = back_to_back_runs(times, slot_duration, max_consecutive_games + 1) if max_consecutive_games else []
+    for team in team_matches:
+        occupancy = [occupied[team, slot] for slot in slots]
+        for other in external.get(team, ()):
+            for slot in slots:
+                if times[slot] <= other < times[slot] + slot_duration:
+                    occupancy[slot] = 1
+        if runs:
+            add_consecutive_limit(model, occupancy, runs, max_consecutive_games)
+        if max_rest_games is not None:
+            played_by = [model.NewBoolVar(f"rest_played_by_{team}_{slot}") for slot in slots]
+            plays_from = [model.NewBoolVar(f"rest_plays_from_{team}_{slot}") for slot in slots]
+            for slot in slots:
+                model.Add(played_by[slot] >= occupancy[slot])
+                model.Add(plays_from[slot] >= occupancy[slot])
+                if slot > 0:
+                    model.Add(played_by[slot] >= played_by[slot - 1])
+                    model.Add(plays_from[slot - 1] >= plays_from[slot])
+            add_rest_limit(model, occupancy, played_by, plays_from, max_rest_games)
+
+    max_slot = model.NewIntVar(0, num_slots - 1, "max_slot")
+    for slot in slots:
+        model.Add(max_slot >= slot).OnlyEnforceIf(slot_used[slot])
+    model.Minimize(sum(slot * var for (_, slot), var in x.items()) + 1000 * max_slot)
+
+    position = {matchup: m for m, matchup in enumerate(matchups)}
+    hinted = {(position[matchup], slot) for slot, placed in (task.get('hint') or {}).items()
+              for matchup in placed if matchup in position}
+    if hinted:
+        for key, var in x.items():
+            model.AddHint(var, key in hinted)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = task['time_limit']
+    if task.get('num_workers') is not None:
+        solver.parameters.num_search_workers = task['num_workers']
+    if task.get('seed') is not None:
+        solver.parameters.random_seed = task['seed']
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None, solver.StatusName(status)
+    assignments = {}
+    for (m, slot), var in x.items():
+        if solver.BooleanValue(var):
+            assignments.setdefault(slot, []).append(matchups[m])
+    return assignments, solver.StatusName(status)
+
+def team_game_times(venues, assignments):
+    """Map each team to its games as (start time, venue index), in time order."""
+    games = {}
+    for v, venue_assignments in enumerate(assignments):
+        for slot, matchups in (venue_assignments or {}).items():
+            for matchup in matchups:
+                for team in matchup:
+                    games.setdefault(team, []).append((venues[v]['times'][slot], v))
+    for played in games.values():
+        played.sort()
+    return games
+
+def venue_conflicts(venues, assignments, slot_duration, max_wait_time):
+    """List (team, message) for games of a team that clash or wait too long across venues."""
+    conflicts = []
+    for team, played in team_game_times(venues, assignments).items():
+        for (start, v), (next_start, w) in zip(played, played[1:]):
+            if v == w:
+                continue
+            if next_start - start < slot_duration:
+                conflicts.append((team, f"Team {team[1]} (Club {team[0]}) is due at {venues[v]['name']} and "
+                                        f"{venues[w]['name']} within {next_start - start} minutes."))
+            elif start // DAY_MINUTES == next_start // DAY_MINUTES and next_start - start > max_wait_time:
+                conflicts.append((team, f"Team {team[1]} (Club {team[0]}) waits {next_start - start} minutes "
+                                        f"between {venues[v]['name']} and {venues[w]['name']} "
+                                        f"(limit {max_wait_time})."))
+    return conflicts
+
+def schedule_venues(teams, allowed_matchups, venues, matches_per_team, slot_duration, allow_more_matches, home_club,
+                    max_wait_time, solver_profile=None, max_consecutive_games=None, max_rest_games=None):
+    """Schedule a tournament over several venues.
+
+    Matchups are first given a venue (`assign_venues`), then each venue's
+    slots are solved as its own model, in parallel. Teams playing at more than
+    one venue are reconciled afterwards: venues where such a team clashes or
+    waits too long are re-solved one at a time, with the team's games at the
+    other venues fixed, until no conflicts remain or RECONCILE_ROUNDS pass.
+    `max_consecutive_games` and `max_rest_games` apply per venue (see
+    `solve_venue`); None leaves them open. Returns `(assignments, notes, status)`, with one dict of slot index to
+    matchups per venue (None when nothing feasible was found).
+    """
+    profile = resolve_solver_profile(solver_profile)
+    time_limit = profile['time_limit'] or 60
+    started = time.monotonic()
+    notes = matchup_problems(teams, allowed_matchups, matches_per_team, 1, False, allow_more_matches, home_club)
+    if notes:
+        return None, notes, 'INFEASIBLE'
+
+    venue_matchups = assign_venues(teams, allowed_matchups, venues, matches_per_team, allow_more_matches, home_club,
+                                   time_limit=max(1.0, time_limit * 0.2), num_workers=profile['num_workers'])
+    if venue_matchups is None:
+        return None, ["Not possible: the matches do not fit the venues' slots."], 'INFEASIBLE'
+
+    # Venues share no team until reconciliation, so their first solves run side by side
+    workers = min(len(venues), profile['num_workers'] or os.cpu_count() or 1)
+
+    def task(v, external, hint, seconds):
+        return {
+            'matchups': venue_matchups[v],
+            'times': venues[v]['times'],
+            'capacity': venues[v]['capacity'],
+            'slot_duration': slot_duration,
+            'max_wait_time': max_wait_time,
+            'max_consecutive_games': max_consecutive_games,
+            'max_rest_games': max_rest_games,
+            'external': external,
+            'hint': hint,
+            'time_limit': max(1.0, seconds),
+            'num_workers': 1 if workers > 1 else profile['num_workers'],
+            'seed': profile['random_seed']
+        }
+
+    tasks = [task(v, {}, None, time_limit * 0.5) for v in range(len(venues))]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(solve_venue, tasks))
+    else:
+        results = [solve_venue(venue_task) for venue_task in tasks]
+    assignments = [placed for placed, _ in results]
+    statuses = [status for _, status in results]
+    failed = [venues[v]['name'] for v, placed in enumerate(assignments) if placed is None]
+    if failed:
+        return None, notes + [f"No feasible schedule found for {', '.join(failed)}."], 'INFEASIBLE'
+
+    shared = sum(1 for played in team_game_times(venues, assignments).values() if len({v for _, v in played}) > 1)
+    conflicts = venue_conflicts(venues, assignments, slot_duration, max_wait_time)
+    rounds = 0
+    while conflicts and rounds < RECONCILE_ROUNDS and time.monotonic() - started < time_limit:
+        rounds += 1
+        games = team_game_times(venues, assignments)
+        affected = sorted({v for team, _ in conflicts for _, v in games[team]})
+        for v in affected:
+            games = team_game_times(venues, assignments)
+            external = {team: [start for start, w in played if w != v] for team, played in games.items()}
+            seconds = (time_limit - (time.monotonic() - started)) / max(1, len(affected))
+            placed, status = solve_venue(task(v, external, assignments[v], seconds))
+            if placed is not None:
+                assignments[v], statuses[v] = placed, status
+        conflicts = venue_conflicts(venues, assignments, slot_duration, max_wait_time)
+
+    if shared:
+        notes.append(f"{shared} team{'s' if shared > 1 else ''} play{'' if shared > 1 else 's'} at more than one "
+                     f"venue; reconciled in {rounds} round{'' if rounds == 1 else 's'}.")
+    notes += [message for _, message in conflicts]
+    status = 'OPTIMAL' if all(status == 'OPTIMAL' for status in statuses) and not conflicts else 'FEASIBLE'
+    return assignments, notes, status
+
+def venue_schedule_to_dict(venues, assignments, teams, notes, status, slot_duration, long_break_time=0,
+                           long_break_frequency=0):
+    """Describe a multi-venue schedule as JSON-friendly data: per-venue slots, per-team games and daily figures.
+
+    Rests in the daily figures count slots of the tournament's long-break settings from each day's first game.
+    """
+    midnight = parse_time('00:00')
+
+    def clock(minutes):
+        return midnight + timedelta(minutes=minutes)
+
+    result = {'status': status, 'warnings': notes, 'venues': [], 'teams': [], 'days': []}
+    if assignments is None:
+        return result
+    days = {}
+    for v, venue in enumerate(venues):
+        entries = []
+        for slot in sorted(assignments[v]):
+            if not assignments[v][slot]:
+                continue
+            start = venue['times'][slot]
+            entries.append({'time': format_time(clock(start)),
+                            'matches': [[{'club': c1, 'team': t1}, {'club': c2, 'team': t2}]
+                                        for (c1, t1), (c2, t2) in assignments[v][slot]]})
+            days.setdefault(venue['day'], {}).setdefault(start, []).extend(assignments[v][slot])
+        result['venues'].append({'name': venue['name'], 'day': venue['day'], 'capacity': venue['capacity'],
+                                 'slots_used': len(entries), 'schedule': entries})
+
+    games = team_game_times(venues, assignments)
+    timing = {}
+    for day, by_time in sorted(days.items()):
+        schedule = [(clock(start), matchups) for start, matchups in sorted(by_time.items())]
+        analysis = analyze_schedule(schedule, teams, slot_duration, long_break_time=long_break_time,
+                                    long_break_frequency=long_break_frequency)
+        _, stats = team_statistics(analysis, schedule, teams)
+        for team, team_stats in stats.items():
+            if team_stats['first_match'] is not None:
+                timing.setdefault(team, {})[day] = {
+                    key: format_time(value) if key in ('first_match', 'last_match') else value
+                    for key, value in team_stats.items()
+                }
+        result['days'].append({'day': day, 'averages': analysis['averages'],
+                               'wait_percentiles': analysis['wait_percentiles']})
+    for team in teams:
+        played = games.get(team, [])
+        result['teams'].append({
+            'club': team[0],
+            'team': team[1],
+            'games': len(played),
+            'venues': sorted({venues[v]['name'] for _, v in played}),
+            'timing': timing.get(team, {})
+        })
+    return result
+
+def schedule_tournament_venues(params, venue_data):
+    """Schedule `generate_and_schedule_matchups` keyword arguments over a list of venues (see `parse_venues`).
+
+    Concurrency comes from the venues' capacities, so the form's concurrency is
+    not used. Returns the result of `venue_schedule_to_dict`.
+    """
+    slot_duration = params['game_time'] + (params['break_time'] if params['spread_games'] else 0)
+    venues = parse_venues(venue_data, params['game_time'], slot_duration, params['long_break_time'],
+                          params['long_break_frequency'])
+    teams, allowed_matchups = tournament_matchups(params['clubs'], params['restricted_clubs'] or set())
+    assignments, notes, status = schedule_venues(
+        teams, allowed_matchups, venues, params['matches_per_team'], slot_duration, params['allow_more_matches'],
+        params['home_club'], params['max_wait_time'], params.get('solver_profile'),
+        params.get('max_consecutive_games'), params.get('max_rest_games')
+    )
+    return venue_schedule_to_dict(venues, assignments, teams, notes, status, slot_duration, params['long_break_time'],
+                                  params['long_break_frequency'])
@@ -0,0 +1,228 @@
+"""Benchmark the scheduler on synthetic tournaments.
+
+    python benchmark.py run --output results.json
+    python benchmark.py compare baseline.json results.json
+
+`run` solves every instance of a suite in a fresh worker process, with a fixed
+seed and a pinned number of CP-SAT workers, and writes the model size,
+build/presolve/solve times, objective, status and peak memory of each to a JSON
+file. `compare` flags instances that got slower, bigger or worse than a stored
+baseline and exits with status 1 if any did.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+
+# name, clubs, teams per club, matches per team, concurrency, restriction density,
+# long break time, long break frequency, max wait time, strategy
+SUITES = {
+    'quick': [
+        ('small', 4, 2, 3, 2, 0.0, 25, 4, 600, 'cp'),
+        ('small-restricted', 5, 2, 3, 2, 0.2, 25, 4, 600, 'cp'),
+        ('medium-wait', 4, 3, 3, 4, 0.0, 25, 4, 60, 'cp'),
+    ],
+    'default': [
+        ('small', 4, 2, 3, 2, 0.0, 25, 4, 600, 'cp'),
+        ('small-restricted', 5, 2, 3, 2, 0.2, 25, 4, 600, 'cp'),
+        ('medium-wait', 4, 3, 3, 4, 0.0, 25, 4, 60, 'cp'),
+        ('medium-long-breaks', 5, 4, 3, 3, 0.1, 40, 3, 80, 'cp'),
+        ('large', 5, 3, 4, 4, 0.0, 25, 4, 80, 'cp'),
+        ('large-restricted', 6, 3, 3, 4, 0.2, 25, 4, 90, 'cp'),
+        ('large-hybrid', 6, 3, 3, 4, 0.2, 25, 4, 90, 'heuristic+cp'),
+        ('infeasible-wait', 4, 3, 4, 2, 0.0, 25, 4, 40, 'cp'),
+    ],
+}
+
+# Relative change beyond which a measured metric counts as a regression, and
+# the smallest absolute change that is not just noise. Model size is exact, so
+# any growth counts.
+TOLERANCE = 0.2
+NOISE = {'build_time': 0.05, 'presolve_time': 0.05, 'solve_time': 0.1, 'peak_rss_kb': 10240}
+EXACT = ('variables', 'constraints')
+
+# How settled a status is, from proven to failed; a higher rank than the baseline is a regression
+STATUS_RANK = {'OPTIMAL': 0, 'INFEASIBLE': 0, 'REJECTED': 0, 'FEASIBLE': 1, 'HEURISTIC': 1, 'LNS': 1, 'UNKNOWN': 2}
+
+def generate_instance(rng, clubs, teams_per_club, matches_per_team, concurrency, restriction_density,
+                      long_break_time, long_break_frequency, max_wait_time, strategy, max_consecutive_games=None,
+                      max_rest_games=None):
+    """Build `solve_slot_assignments` keyword arguments for a synthetic tournament.
+
+    Each pair of clubs is restricted with probability `restriction_density`.
+    """
+    names = [f"Club{i + 1}" for i in range(clubs)]
+    club_teams = {name: [f"{name}-{j + 1}" for j in range(teams_per_club)] for name in names}
+    restricted = {pair for pair in itertools.combinations(names, 2) if rng.random() < restriction_density}
+    return {
+        'clubs': club_teams,
+        'restricted_clubs': restricted,
+        'matches_per_team': matches_per_team,
+        'concurrency': concurrency,
+        'game_time': 15,
+        'break_time': 5,
+        'spread_games': True,
+        'force_max_concurrency': False,
+        'allow_more_matches': False,
+        'home_club': '',
+        'long_break_time': long_break_time,
+        'long_break_frequency': long_break_frequency,
+        'strategy': strategy,
+        'max_wait_time': max_wait_time,
+        'max_consecutive_games': max_consecutive_games,
+        'max_rest_games': max_rest_games
+    }
+
+def run_instance(task):
+    """Solve one instance and return its measurements; runs in its own process so peak RSS is its own."""
+    from app.lns import schedule_objective
+    from app.utils import solve_slot_assignments, tournament_matchups
+
+    name, spec, seed, workers, time_limit, limits = task
+    params = generate_instance(random.Random(f"{seed}-{name}"), *spec, **limits)
+    teams, allowed_matchups = tournament_matchups(params.pop('clubs'), params.pop('restricted_clubs'))
+    stats = {}
+    started = time.perf_counter()
+    try:
+        slot_assignments, _, status = solve_slot_assignments(
+            teams, allowed_matchups, solver_profile={'time_limit': time_limit, 'num_workers': workers,
+                                                     'random_seed': seed},
+            stats=stats, **params
+        )
+    except Exception as exc:
+        slot_assignments, status = None, 'ERROR'
+        stats['error'] = f"{type(exc).__name__}: {exc}"
+    result = {
+        'name': name,
+        'spec': dict(zip(('clubs', 'teams_per_club', 'matches_per_team', 'concurrency', 'restriction_density',
+                          'long_break_time', 'long_break_frequency', 'max_wait_time', 'strategy'), spec)),
+        'teams': len(teams),
+        'matchups': len(allowed_matchups),
+        'build_time': None,
+        'variables': None,
+        'constraints': None,
+        'presolve_time': None,
+        'solve_time': None,
+        'objective': None,
+        'wall_time': time.perf_counter() - started,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+    result.update(stats)
+    result['status'] = status
+    if result['objective'] is None and slot_assignments is not None:
+        result['objective'] = schedule_objective(slot_assignments)
+    return result
+
+def run_suite(suite, seed=0, workers=1, time_limit=30, only=None, max_consecutive_games=None, max_rest_games=None):
+    """Run a suite and return the result document.
+
+    `max_consecutive_games` and `max_rest_games` apply to every instance.
+    """
+    instances = [(entry[0], entry[1:]) for entry in SUITES[suite] if not only or entry[0] in only]
+    limits = {'max_consecutive_games': max_consecutive_games, 'max_rest_games': max_rest_games}
+    tasks = [(name, spec, seed, workers, time_limit, limits) for name, spec in instances]
+    results = []
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_instance, tasks):
+            print(f"{result['name']:20s} {result['status']:10s} objective={result['objective']} "
+                  f"build={_seconds(result['build_time'])} presolve={_seconds(result['presolve_time'])} "
+                  f"solve={_seconds(result['solve_time'])} rss={result['peak_rss_kb'] // 1024}MB", flush=True)
+            results.append(result)
+    from ortools import __version__ as ortools_version
+    return {
+        'meta': {
+            'suite': suite,
+            'seed': seed,
+            'workers': workers,
+            'time_limit': time_limit,
+            'max_consecutive_games': max_consecutive_games,
+            'max_rest_games': max_rest_games,
+            'python': platform.python_version(),
+            'ortools': ortools_version,
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results
+    }
+
+def compare(baseline, current, tolerance=TOLERANCE):
+    """Return a list of regression messages between two result documents."""
+    regressions = []
+    for key in ('seed', 'workers', 'time_limit', 'max_consecutive_games', 'max_rest_games'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            regressions.append(f"Settings differ: {key} {baseline['meta'].get(key)} -> {current['meta'].get(key)}; "
+                               f"numbers are not comparable.")
+    before = {result['name']: result for result in baseline['results']}
+    for result in current['results']:
+        old = before.get(result['name'])
+        if old is None:
+            continue
+        name = result['name']
+        old_rank, rank = STATUS_RANK.get(old['status'], 3), STATUS_RANK.get(result['status'], 3)
+        if rank > old_rank or (rank == old_rank == 0 and result['status'] != old['status']):
+            regressions.append(f"{name}: status {old['status']} -> {result['status']}")
+        if old['objective'] is not None and (result['objective'] is None or result['objective'] > old['objective']):
+            regressions.append(f"{name}: objective {old['objective']} -> {result['objective']}")
+        for metric in EXACT + tuple(NOISE):
+            if old.get(metric) is None or result.get(metric) is None:
+                continue
+            change = result[metric] - old[metric]
+            if change > NOISE.get(metric, 0) and change > (0 if metric in EXACT else tolerance) * old[metric]:
+                regressions.append(f"{name}: {metric} {old[metric]:.6g} -> {result[metric]:.6g} "
+                                   f"(+{100 * change / old[metric] if old[metric] else float('inf'):.0f}%)")
+    return regressions
+
+def _seconds(value):
+    return '-' if value is None else f"{value:.3f}s"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scheduler on synthetic tournaments.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run a benchmark suite")
+    run.add_argument('--suite', choices=sorted(SUITES), default='default')
+    run.add_argument('--only', nargs='*', help="run only these instances")
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--workers', type=int, default=1, help="CP-SAT search workers (pinned for reproducibility)")
+    run.add_argument('--time-limit', type=float, default=30, help="seconds per instance")
+    run.add_argument('--max-consecutive', type=int, help="max consecutive games per team in every instance")
+    run.add_argument('--max-rest', type=int, help="max slots a team sits out between games in every instance")
+    run.add_argument('--output', default='bench_results.json')
+    run.add_argument('--baseline', help="compare against this result file after running")
+    run.add_argument('--tolerance', type=float, default=TOLERANCE)
+    check = commands.add_parser('compare', help="compare a result file against a baseline")
+    check.add_argument('baseline')
+    check.add_argument('current')
+    check.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        current = run_suite(args.suite, seed=args.seed, workers=args.workers, time_limit=args.time_limit,
+                            only=args.only, max_consecutive_games=args.max_consecutive,
+                            max_rest_games=args.max_rest)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"Wrote {args.output}")
+        if not args.baseline:
+            return 0
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not regressions:
+        print("No regressions.")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
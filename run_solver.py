@@ -0,0 +1,4 @@
+from app.solver_service import main
+
+if __name__ == '__main__':
+    main()
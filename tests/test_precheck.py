@@ -0,0 +1,139 @@
+import pytest
+
+from app.precheck import horizon_problems, matchup_problems, min_slots, streak_problems, team_match_bounds
+from app.utils import slot_offsets, tournament_matchups
+
+SLOT_DURATION = 20
+
+# (clubs as team counts, matches per team, concurrency, force max concurrency, allow more matches, restricted clubs)
+TOURNAMENTS = [
+    ({'A': 1, 'B': 1, 'C': 1}, 2, 1, False, False, set()),
+    ({'A': 1, 'B': 1, 'C': 1}, 3, 1, False, False, set()),
+    ({'A': 1, 'B': 1, 'C': 1}, 1, 1, False, True, set()),
+    ({'A': 2, 'B': 1}, 2, 1, False, False, set()),
+    ({'A': 2, 'B': 2}, 2, 2, False, False, set()),
+    ({'A': 2, 'B': 2}, 2, 2, True, False, set()),
+    ({'A': 2, 'B': 1, 'C': 1}, 2, 2, False, False, set()),
+    ({'A': 2, 'B': 1, 'C': 1}, 2, 2, True, False, set()),
+    ({'A': 1, 'B': 1, 'C': 1, 'D': 1}, 3, 2, False, False, set()),
+    ({'A': 1, 'B': 1, 'C': 1, 'D': 1}, 2, 2, False, False, {('A', 'B')}),
+    ({'A': 1, 'B': 1, 'C': 1, 'D': 1}, 3, 2, False, False, {('A', 'B')}),
+    ({'A': 1, 'B': 1, 'C': 1, 'D': 1, 'E': 1}, 2, 2, True, False, set()),
+]
+
+# (long break time, long break frequency, max wait time, max consecutive games)
+SETTINGS = [
+    (0, 0, None, None),
+    (0, 0, 40, None),
+    (0, 0, None, 1),
+    (30, 2, 40, None),
+    (30, 2, 60, 1),
+    (10, 3, 60, 2),
+]
+
+def schedule_exists(teams, allowed_matchups, matches_per_team, concurrency, force_max_concurrency,
+                    allow_more_matches, offsets, max_wait_time, max_consecutive_games):
+    """Search every slot assignment within len(offsets) slots for one the scheduling model accepts."""
+    num_slots = len(offsets)
+    bounds = team_match_bounds(teams, matches_per_team, allow_more_matches, '')
+    runs = [slot for slot in range(num_slots - (max_consecutive_games or 0))
+            if max_consecutive_games and offsets[slot + max_consecutive_games] - offsets[slot]
+            == max_consecutive_games * SLOT_DURATION]
+
+    def valid(slots):
+        team_slots = {team: [] for team in teams}
+        counts = [0] * num_slots
+        for (t1, t2), slot in zip(allowed_matchups, slots):
+            if slot is not None:
+                team_slots[t1].append(slot)
+                team_slots[t2].append(slot)
+                counts[slot] += 1
+        if not counts[0]:
+            return False
+        if force_max_concurrency:
+            used = [count > 0 for count in counts]
+            if any(0 < count < concurrency for count in counts) or any(b and not a for a, b in zip(used, used[1:])):
+                return False
+        for team, played in team_slots.items():
+            low, high = bounds[team]
+            if not low <= len(played) <= high:
+                return False
+            played.sort()
+            if max_wait_time is not None and any(offsets[b] - offsets[a] > max_wait_time
+                                                 for a, b in zip(played, played[1:])):
+                return False
+            if any(sum(slot in played for slot in range(start, start + max_consecutive_games + 1))
+                   > max_consecutive_games for start in runs):
+                return False
+        return True
+
+    def search(index, slots, busy, counts):
+        if index == len(allowed_matchups):
+            return valid(slots)
+        t1, t2 = allowed_matchups[index]
+        if search(index + 1, slots + [None], busy, counts):
+            return True
+        for slot in range(num_slots):
+            if counts[slot] < concurrency and (t1, slot) not in busy and (t2, slot) not in busy:
+                counts[slot] += 1
+                if search(index + 1, slots + [slot], busy | {(t1, slot), (t2, slot)}, counts):
+                    return True
+                counts[slot] -= 1
+        return False
+
+    return search(0, [], frozenset(), [0] * num_slots)
+
+def fewest_slots(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches, restricted_clubs,
+                 long_break_time, long_break_frequency, max_wait_time, max_consecutive_games):
+    """Return the fewest slots any schedule takes by exhaustive search, or None when none fits in 6."""
+    teams, allowed_matchups = tournament_matchups({club: [f"{club}{i + 1}" for i in range(count)]
+                                                   for club, count in clubs.items()}, restricted_clubs)
+    effective_concurrency = min(concurrency, len(teams) // 2)
+    for num_slots in range(1, 7):
+        offsets = slot_offsets(num_slots, SLOT_DURATION, long_break_time, long_break_frequency)
+        if schedule_exists(teams, allowed_matchups, matches_per_team, effective_concurrency, force_max_concurrency,
+                           allow_more_matches, offsets, max_wait_time, max_consecutive_games):
+            return num_slots
+    return None
+
+@pytest.mark.parametrize('clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches, '
+                         'restricted_clubs', TOURNAMENTS)
+def test_matchup_problems_only_reject_unschedulable_tournaments(clubs, matches_per_team, concurrency,
+                                                                force_max_concurrency, allow_more_matches,
+                                                                restricted_clubs):
+    teams, allowed_matchups = tournament_matchups({club: [f"{club}{i + 1}" for i in range(count)]
+                                                   for club, count in clubs.items()}, restricted_clubs)
+    effective_concurrency = min(concurrency, len(teams) // 2)
+    problems = matchup_problems(teams, allowed_matchups, matches_per_team, effective_concurrency,
+                                force_max_concurrency, allow_more_matches, '')
+    if problems:
+        assert fewest_slots(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches,
+                            restricted_clubs, 0, 0, None, None) is None
+
+@pytest.mark.parametrize('clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches, '
+                         'restricted_clubs', TOURNAMENTS)
+@pytest.mark.parametrize('long_break_time, long_break_frequency, max_wait_time, max_consecutive_games', SETTINGS)
+def test_min_slots_is_a_lower_bound(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches,
+                                    restricted_clubs, long_break_time, long_break_frequency, max_wait_time,
+                                    max_consecutive_games):
+    fewest = fewest_slots(clubs, matches_per_team, concurrency, force_max_concurrency, allow_more_matches,
+                          restricted_clubs, long_break_time, long_break_frequency, max_wait_time,
+                          max_consecutive_games)
+    if fewest is None:
+        pytest.skip("no schedule within 6 slots")
+    num_teams = sum(clubs.values())
+    effective_concurrency = min(concurrency, num_teams // 2)
+    assert min_slots(matches_per_team, num_teams, effective_concurrency, SLOT_DURATION, long_break_time,
+                     long_break_frequency, max_wait_time, max_consecutive_games) <= fewest
+    wait = max_wait_time if max_wait_time is not None else 10 ** 6
+    assert not horizon_problems(matches_per_team, num_teams, effective_concurrency, SLOT_DURATION, long_break_time,
+                                long_break_frequency, wait, fewest)
+    assert not streak_problems(matches_per_team, num_teams, effective_concurrency, force_max_concurrency,
+                               SLOT_DURATION, long_break_time, long_break_frequency, wait, max_consecutive_games,
+                               fewest)
+
+def test_brute_force_sees_the_simplest_cases():
+    assert fewest_slots({'A': 1, 'B': 1, 'C': 1}, 2, 1, False, False, set(), 0, 0, None, None) == 3
+    # Every two games of a triangle share a team, so with one game in a row they need a free slot between them
+    assert fewest_slots({'A': 1, 'B': 1, 'C': 1}, 2, 1, False, False, set(), 0, 0, None, 1) == 5
+    assert fewest_slots({'A': 2, 'B': 1}, 2, 1, False, False, set(), 0, 0, None, None) is None